@@ -0,0 +1,6 @@
+"""Code shared by the Auto-quiz services.
+
+Each service image copies this package next to its own modules (see the
+build contexts in docker-compose.yml). To run a service outside Docker, put
+the repository root on PYTHONPATH.
+"""
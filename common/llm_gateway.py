@@ -0,0 +1,548 @@
+"""Shared entry point for Gemini calls.
+
+Keeps one GenerativeModel instance per model name for the lifetime of the
+process, sizes every prompt before it is sent and routes small jobs to the
+faster model. Prompts that cannot fit the context window are truncated or
+rejected here instead of failing after a network round-trip.
+
+Identical requests that are already in flight are coalesced: later callers
+share the first caller's response instead of sending their own. Requests
+that do go out pass a token-bucket rate limiter that serves waiting callers
+by priority, then arrival order.
+
+The token bucket and the in-flight table live in a small SQLite database
+(GEMINI_STATE_PATH), so every worker process and every service pointed at
+the same file shares one request budget and one set of in-flight requests.
+Callers in other processes follow a flight by polling the chunks its owner
+stores.
+"""
+import collections
+import hashlib
+import functools
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import google.generativeai as genai
+
+from common import metrics
+
+
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+# Alternate endpoint, e.g. the fake backend used by the load-test harness.
+GEMINI_API_ENDPOINT = os.environ.get("GEMINI_API_ENDPOINT")
+
+if GEMINI_API_ENDPOINT:
+    genai.configure(api_key=GEMINI_API_KEY, transport="rest",
+                    client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+else:
+    genai.configure(api_key=GEMINI_API_KEY)
+
+FAST_MODEL = os.environ.get("GEMINI_FAST_MODEL", "gemini-1.5-flash-latest")
+PRO_MODEL = os.environ.get("GEMINI_PRO_MODEL", "gemini-1.5-pro-latest")
+
+# Input context windows (tokens) of the models above.
+CONTEXT_WINDOWS = {
+    FAST_MODEL: int(os.environ.get("GEMINI_FAST_CONTEXT_TOKENS", 1048576)),
+    PRO_MODEL: int(os.environ.get("GEMINI_PRO_CONTEXT_TOKENS", 2097152)),
+}
+
+# Jobs at or below both limits go to FAST_MODEL.
+FAST_MAX_PROMPT_TOKENS = int(os.environ.get("GEMINI_FAST_MAX_PROMPT_TOKENS", 8000))
+FAST_MAX_OUTPUT_TOKENS = int(os.environ.get("GEMINI_FAST_MAX_OUTPUT_TOKENS", 2048))
+
+DEFAULT_OUTPUT_TOKENS = 2048
+
+# Rate limiter and in-flight state shared by all processes that use this file.
+GEMINI_STATE_PATH = os.environ.get("GEMINI_STATE_PATH", "gemini_gateway.db")
+
+# Budget for requests sent by all of those processes together.
+REQUESTS_PER_MINUTE = float(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", 60))
+REQUEST_BURST = int(os.environ.get("GEMINI_REQUEST_BURST", 10))
+# Tokens background requests leave in the bucket for interactive ones.
+BACKGROUND_RESERVE = min(int(os.environ.get("GEMINI_BACKGROUND_RESERVE", 2)), REQUEST_BURST - 1)
+
+# Lower values are served first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# An in-flight request's claim expires unless its owner renews it.
+FLIGHT_LEASE_SECONDS = 30
+FLIGHT_POLL_SECONDS = 0.1
+# Finished flights are kept this long for followers still reading them.
+FLIGHT_RETENTION_SECONDS = 300
+
+# Local estimates this close to a limit are confirmed with count_tokens.
+CHARS_PER_TOKEN = 4
+ESTIMATE_MARGIN = 0.2
+# Confirmed counts kept per process, by prompt hash.
+MAX_CACHED_TOKEN_COUNTS = 256
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+class PromptTooLargeError(Exception):
+    pass
+
+
+class CoalescedRequestError(Exception):
+    """The request this caller joined in another process failed or was abandoned."""
+
+
+class _RateLimiter:
+    """Token bucket in the shared state database.
+
+    Waiters in this process are served in (priority, arrival) order, and only
+    the first of them polls the shared bucket. Across processes, background
+    requests leave BACKGROUND_RESERVE tokens for interactive ones.
+    """
+
+    def __init__(self, state, per_minute, burst):
+        self._state = state
+        self._rate = per_minute / 60.0
+        self._capacity = burst
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE):
+        reserve = BACKGROUND_RESERVE if priority > PRIORITY_INTERACTIVE else 0
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            while True:
+                if self._waiters[0] == ticket:
+                    wait = self._state.take_token(self._rate, self._capacity, reserve)
+                    if not wait:
+                        heapq.heappop(self._waiters)
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+
+class _SharedState:
+    """SQLite tables behind the rate limiter and cross-process coalescing."""
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS rate_limit (
+            name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS flight_claims (
+            key TEXT PRIMARY KEY,
+            flight_id TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS flights (
+            flight_id TEXT PRIMARY KEY,
+            lease_until REAL NOT NULL,
+            done INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            finished_at REAL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS flight_chunks (
+            flight_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (flight_id, seq)
+        )
+        """,
+    )
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def _connect(self):
+        # Autocommit, so read-modify-write sequences can take the write lock up front.
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def take_token(self, rate, capacity, reserve):
+        """Take one token and return 0, or return the seconds until one is available."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM rate_limit WHERE name = 'gemini'").fetchone()
+            tokens = float(capacity) if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            needed = 1 + reserve
+            if tokens >= needed:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (needed - tokens) / rate
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limit (name, tokens, updated_at) VALUES ('gemini', ?, ?)",
+                (tokens, now),
+            )
+            conn.execute("COMMIT")
+            return wait
+        finally:
+            conn.close()
+
+    def claim_flight(self, key):
+        """Return (flight_id, owned): a new flight for key, or the live one to follow."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(
+                "SELECT f.flight_id FROM flight_claims c JOIN flights f ON f.flight_id = c.flight_id "
+                "WHERE c.key = ? AND f.done = 0 AND f.lease_until >= ?",
+                (key, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute("COMMIT")
+                return row[0], False
+
+            old = now - FLIGHT_RETENTION_SECONDS
+            conn.execute(
+                "DELETE FROM flight_chunks WHERE flight_id IN "
+                "(SELECT flight_id FROM flights WHERE finished_at < ? OR lease_until < ?)",
+                (old, old),
+            )
+            conn.execute("DELETE FROM flights WHERE finished_at < ? OR lease_until < ?", (old, old))
+            flight_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO flights (flight_id, lease_until) VALUES (?, ?)",
+                (flight_id, now + FLIGHT_LEASE_SECONDS),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO flight_claims (key, flight_id) VALUES (?, ?)", (key, flight_id)
+            )
+            conn.execute("COMMIT")
+            return flight_id, True
+        finally:
+            conn.close()
+
+    def renew_flight(self, flight_id):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE flights SET lease_until = ? WHERE flight_id = ? AND done = 0",
+                (time.time() + FLIGHT_LEASE_SECONDS, flight_id),
+            )
+
+    def publish_chunk(self, flight_id, seq, text):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO flight_chunks (flight_id, seq, text) VALUES (?, ?, ?)", (flight_id, seq, text)
+            )
+
+    def finish_flight(self, flight_id, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE flights SET done = 1, error = ?, finished_at = ? WHERE flight_id = ?",
+                (None if error is None else str(error) or type(error).__name__, time.time(), flight_id),
+            )
+
+    def read_flight(self, flight_id, after_seq):
+        """Return (chunks after after_seq, done, error, lease_until) for a flight."""
+        with self._connect() as conn:
+            flight = conn.execute(
+                "SELECT done, error, lease_until FROM flights WHERE flight_id = ?", (flight_id,)
+            ).fetchone()
+            chunks = conn.execute(
+                "SELECT seq, text FROM flight_chunks WHERE flight_id = ? AND seq > ? ORDER BY seq",
+                (flight_id, after_seq),
+            ).fetchall()
+        if flight is None:
+            return chunks, True, "Coalesced request was discarded", 0
+        return chunks, bool(flight[0]), flight[1], flight[2]
+
+
+class _Flight:
+    """Response chunks of one in-flight request, readable by every caller that joined it."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def follow(self):
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                batch = self.chunks[index:]
+                index = len(self.chunks)
+                if not batch:
+                    if self.error is not None:
+                        raise self.error
+                    return
+            yield from batch
+
+
+_state = _SharedState(GEMINI_STATE_PATH)
+_rate_limiter = _RateLimiter(_state, REQUESTS_PER_MINUTE, REQUEST_BURST)
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+_token_counts = collections.OrderedDict()
+_token_counts_lock = threading.Lock()
+
+
+def get_model(model_name):
+    model = _models.get(model_name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(model_name)
+            if model is None:
+                model = genai.GenerativeModel(model_name)
+                _models[model_name] = model
+    return model
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate, no network call."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _near(value, limit):
+    return abs(value - limit) <= limit * ESTIMATE_MARGIN
+
+
+def count_prompt_tokens(prompt, model_name, priority=PRIORITY_INTERACTIVE):
+    """Local estimate, confirmed by count_tokens only when it sits near a limit.
+
+    Confirmed counts are cached by prompt hash. The count_tokens call itself
+    is coalesced and rate limited like a generate request, so identical
+    prompts arriving together are counted once.
+    """
+    estimate = estimate_tokens(prompt)
+    if not (_near(estimate, FAST_MAX_PROMPT_TOKENS) or _near(estimate, CONTEXT_WINDOWS[model_name])):
+        return estimate
+    key = _request_key("count_tokens", model_name, prompt)
+    with _token_counts_lock:
+        prompt_tokens = _token_counts.get(key)
+        if prompt_tokens is not None:
+            _token_counts.move_to_end(key)
+            metrics.count("llm_token_count_cached")
+            return prompt_tokens
+    try:
+        send = functools.partial(_send_count_tokens, model_name=model_name, prompt=prompt, priority=priority)
+        prompt_tokens = int("".join(_coalesced(key, f"{model_name} count_tokens", send)))
+    except Exception as e:
+        print(f"[LLM WARN] count_tokens failed, using local estimate: {e}")
+        return estimate
+    with _token_counts_lock:
+        _token_counts[key] = prompt_tokens
+        while len(_token_counts) > MAX_CACHED_TOKEN_COUNTS:
+            _token_counts.popitem(last=False)
+    return prompt_tokens
+
+
+def choose_model(prompt_tokens, expected_output_tokens):
+    if prompt_tokens <= FAST_MAX_PROMPT_TOKENS and expected_output_tokens <= FAST_MAX_OUTPUT_TOKENS:
+        return FAST_MODEL
+    return PRO_MODEL
+
+
+def _truncate(prompt, prompt_tokens, max_tokens):
+    # Variable content (transcript, summary) always sits at the end of our
+    # prompts, so cutting the tail keeps the instructions intact.
+    keep_chars = int(len(prompt) * max_tokens / prompt_tokens)
+    return prompt[:keep_chars]
+
+
+def plan(prompt, expected_output_tokens=DEFAULT_OUTPUT_TOKENS, truncate=False,
+         priority=PRIORITY_INTERACTIVE):
+    """Return (model_name, prompt, prompt_tokens) for a prompt.
+
+    Raises PromptTooLargeError if the prompt does not fit the largest
+    context window and truncate is False.
+    """
+    prompt_tokens = count_prompt_tokens(prompt, FAST_MODEL, priority)
+    model_name = choose_model(prompt_tokens, expected_output_tokens)
+    if model_name != FAST_MODEL:
+        prompt_tokens = count_prompt_tokens(prompt, model_name, priority)
+
+    max_tokens = CONTEXT_WINDOWS[model_name] - expected_output_tokens
+    if prompt_tokens > max_tokens:
+        if not truncate:
+            raise PromptTooLargeError(
+                f"Prompt is ~{prompt_tokens} tokens; {model_name} accepts at most {max_tokens}."
+            )
+        prompt = _truncate(prompt, prompt_tokens, max_tokens)
+        print(f"[LLM] Truncated prompt from ~{prompt_tokens} to ~{max_tokens} tokens")
+        prompt_tokens = max_tokens
+
+    return model_name, prompt, prompt_tokens
+
+
+def _keep_flight(flight_id, stopped):
+    while not stopped.wait(FLIGHT_LEASE_SECONDS / 3):
+        try:
+            _state.renew_flight(flight_id)
+        except sqlite3.Error as e:
+            print(f"[LLM WARN] Could not renew flight {flight_id}: {e}")
+
+
+def _send(publish, model_name, prompt, priority, stream):
+    """Send a generate request, passing each chunk of the response to publish."""
+    with metrics.stage("llm_rate_limit_wait"):
+        _rate_limiter.acquire(priority)
+    metrics.count("llm_requests")
+    with metrics.stage("llm_request"):
+        if stream:
+            for chunk in get_model(model_name).generate_content(prompt, stream=True):
+                publish(chunk.text)
+        else:
+            publish(get_model(model_name).generate_content(prompt).text)
+
+
+def _send_count_tokens(publish, model_name, prompt, priority):
+    """Send a count_tokens request and publish the total as text."""
+    with metrics.stage("llm_rate_limit_wait"):
+        _rate_limiter.acquire(priority)
+    metrics.count("llm_count_tokens_requests")
+    with metrics.stage("llm_count_tokens"):
+        publish(str(get_model(model_name).count_tokens(prompt).total_tokens))
+
+
+def _follow_remote(flight_id, flight):
+    """Publish the chunks another process stores for a flight until it finishes.
+
+    Returns True if that process stopped renewing its claim before sending
+    anything, in which case the caller should send the request itself.
+    """
+    seq = 0
+    while True:
+        chunks, done, error, lease_until = _state.read_flight(flight_id, seq)
+        for seq, text in chunks:
+            flight.publish(text)
+        if chunks:
+            continue
+        if done:
+            if error is not None:
+                raise CoalescedRequestError(error)
+            return False
+        if lease_until < time.time():
+            if seq == 0:
+                return True
+            raise CoalescedRequestError("The process sending this request stopped responding")
+        time.sleep(FLIGHT_POLL_SECONDS)
+
+
+def _run_flight(key, flight, label, send):
+    """Claim key and call send(publish), or follow the process that holds the claim.
+
+    Whatever send publishes is stored for followers in other processes too.
+    """
+    error = None
+    try:
+        flight_id, owned = _state.claim_flight(key)
+        while not owned:
+            metrics.count("llm_coalesced_remote")
+            print(f"[LLM] Following {label} request {key[:12]} from another process")
+            if not _follow_remote(flight_id, flight):
+                break
+            # Its owner went away before sending anything: claim it again.
+            flight_id, owned = _state.claim_flight(key)
+        if owned:
+            seq = 0
+
+            def publish(text):
+                nonlocal seq
+                seq += 1
+                flight.publish(text)
+                _state.publish_chunk(flight_id, seq, text)
+
+            stopped = threading.Event()
+            threading.Thread(target=_keep_flight, args=(flight_id, stopped), daemon=True).start()
+            flight_error = None
+            try:
+                send(publish)
+            except Exception as e:
+                flight_error = e
+                raise
+            finally:
+                stopped.set()
+                _state.finish_flight(flight_id, flight_error)
+    except Exception as e:
+        error = e
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
+        flight.finish(error)
+
+
+def _request_key(kind, model_name, prompt):
+    return hashlib.sha256(f"{kind}\n{model_name}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+def _coalesced(key, label, send):
+    """Yield response chunks, joining an identical request already in flight if there is one.
+
+    The request runs in its own thread, so callers that joined it still get
+    the response if the caller that started it goes away. Only the first
+    caller in each process claims the request in the shared state; if
+    another process already holds it, that thread follows it instead.
+    """
+    with _in_flight_lock:
+        flight = _in_flight.get(key)
+        started = flight is None
+        if started:
+            flight = _Flight()
+            _in_flight[key] = flight
+    if started:
+        threading.Thread(
+            target=_run_flight,
+            args=(key, flight, label, send),
+            daemon=True
+        ).start()
+    else:
+        metrics.count("llm_coalesced")
+        print(f"[LLM] Joined in-flight {label} request {key[:12]}")
+    return flight.follow()
+
+
+def generate(prompt, expected_output_tokens=DEFAULT_OUTPUT_TOKENS, truncate=False,
+             priority=PRIORITY_INTERACTIVE):
+    """Generate text for a prompt on the model picked by plan()."""
+    model_name, prompt, prompt_tokens = plan(prompt, expected_output_tokens, truncate, priority)
+    metrics.count(f"llm_routed_{'fast' if model_name == FAST_MODEL else 'pro'}")
+    print(f"[LLM] {model_name}: ~{prompt_tokens} prompt tokens, ~{expected_output_tokens} output tokens expected")
+    send = functools.partial(_send, model_name=model_name, prompt=prompt, priority=priority, stream=False)
+    return "".join(_coalesced(_request_key("generate", model_name, prompt), model_name, send)).strip()
+
+
+def generate_stream(prompt, expected_output_tokens=DEFAULT_OUTPUT_TOKENS, truncate=False,
+                    priority=PRIORITY_INTERACTIVE):
+    """Like generate(), but yields the response text chunk by chunk as it is produced."""
+    model_name, prompt, prompt_tokens = plan(prompt, expected_output_tokens, truncate, priority)
+    metrics.count(f"llm_routed_{'fast' if model_name == FAST_MODEL else 'pro'}")
+    print(f"[LLM] {model_name} (stream): ~{prompt_tokens} prompt tokens, ~{expected_output_tokens} output tokens expected")
+    send = functools.partial(_send, model_name=model_name, prompt=prompt, priority=priority, stream=True)
+    yield from _coalesced(_request_key("generate", model_name, prompt), model_name, send)
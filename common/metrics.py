@@ -0,0 +1,164 @@
+"""Prometheus metrics and trace IDs shared by the Auto-quiz services.
+
+Every service calls init_app(app, "<service>"), which:
+- serves the metrics at /metrics in Prometheus text format,
+- times every HTTP request,
+- reads the X-Trace-Id header (or starts a new trace) and echoes it back.
+
+Pipeline stages are timed with `with metrics.stage("name"):` and simple
+occurrences are counted with metrics.count("event"). Outgoing HTTP calls to
+the other services pass headers=metrics.trace_headers() so one trace ID
+follows a request through speech_to_text, the summarizer and the quiz engine.
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates all
+worker processes.
+"""
+import functools
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+
+TRACE_HEADER = "X-Trace-Id"
+
+# From cache lookups (ms) up to long transcriptions (an hour).
+STAGE_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 1800, 3600,
+)
+
+STAGE_SECONDS = Histogram(
+    "autoquiz_stage_duration_seconds",
+    "Duration of pipeline stages",
+    ["service", "stage", "outcome"],
+    buckets=STAGE_BUCKETS,
+)
+HTTP_SECONDS = Histogram(
+    "autoquiz_http_request_duration_seconds",
+    "Duration of HTTP requests served",
+    ["service", "endpoint", "method", "status"],
+    buckets=STAGE_BUCKETS,
+)
+EVENTS = Counter(
+    "autoquiz_events_total",
+    "Counted pipeline events (cache hits, retries, coalesced calls, ...)",
+    ["service", "event"],
+)
+
+_service = os.environ.get("SERVICE_NAME", "autoquiz")
+_local = threading.local()
+
+
+def trace_id():
+    """Trace ID of the current request or bound background thread, if any."""
+    bound = getattr(_local, "trace_id", None)
+    if bound:
+        return bound
+    if has_request_context():
+        return getattr(g, "trace_id", None)
+    return None
+
+
+def trace_headers():
+    current = trace_id()
+    return {TRACE_HEADER: current} if current else {}
+
+
+@contextmanager
+def bind_trace(current):
+    """Attribute work in this thread (e.g. a background job) to a trace."""
+    previous = getattr(_local, "trace_id", None)
+    _local.trace_id = current
+    try:
+        yield
+    finally:
+        _local.trace_id = previous
+
+
+def in_current_trace(fn):
+    """Wrap fn so that, when run in another thread, it keeps the caller's trace ID."""
+    current = trace_id()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with bind_trace(current):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        STAGE_SECONDS.labels(_service, name, outcome).observe(time.perf_counter() - start)
+
+
+def timed(name):
+    """Decorator form of stage()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(name, seconds, outcome="ok"):
+    """Record a stage duration measured by the caller (e.g. time to first item)."""
+    STAGE_SECONDS.labels(_service, name, outcome).observe(seconds)
+
+
+def count(event, amount=1):
+    EVENTS.labels(_service, event).inc(amount)
+
+
+def render():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def init_app(app, service):
+    global _service
+    _service = service
+
+    @app.before_request
+    def start_trace():
+        g.trace_id = request.headers.get(TRACE_HEADER) or uuid.uuid4().hex
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def finish_trace(response):
+        response.headers[TRACE_HEADER] = g.trace_id
+        if request.endpoint != "metrics":
+            HTTP_SECONDS.labels(
+                _service, request.endpoint or "unknown", request.method, str(response.status_code)
+            ).observe(time.perf_counter() - g.request_start)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        """Prometheus scrape endpoint"""
+        return Response(render(), content_type=CONTENT_TYPE_LATEST)
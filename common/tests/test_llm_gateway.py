@@ -0,0 +1,371 @@
+import threading
+import time
+import types
+
+import pytest
+
+from common import llm_gateway
+from common.llm_gateway import CoalescedRequestError, _Flight, _RateLimiter, _SharedState
+
+
+class StubModel:
+    """GenerativeModel stand-in that counts calls and can hold them until released."""
+
+    def __init__(self, text="response"):
+        self.text = text
+        self.error = None
+        self.generate_calls = 0
+        self.count_calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def generate_content(self, prompt, stream=False):
+        self.generate_calls += 1
+        if stream:
+            return self._stream()
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return types.SimpleNamespace(text=self.text)
+
+    def _stream(self):
+        # The first chunk arrives straight away, the rest once released.
+        for i, word in enumerate(self.text.split()):
+            if i == 1:
+                self.release.wait(5)
+            yield types.SimpleNamespace(text=word)
+
+    def count_tokens(self, prompt):
+        self.count_calls += 1
+        self.release.wait(5)
+        return types.SimpleNamespace(total_tokens=len(prompt) // llm_gateway.CHARS_PER_TOKEN)
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.priorities = []
+
+    def acquire(self, priority=llm_gateway.PRIORITY_INTERACTIVE):
+        self.priorities.append(priority)
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    state = _SharedState(str(tmp_path / "gateway.db"))
+    monkeypatch.setattr(llm_gateway, "_state", state)
+    monkeypatch.setattr(llm_gateway, "FLIGHT_POLL_SECONDS", 0.01)
+    return state
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = RecordingLimiter()
+    monkeypatch.setattr(llm_gateway, "_rate_limiter", limiter)
+    return limiter
+
+
+@pytest.fixture
+def model(state, limiter, monkeypatch):
+    model = StubModel()
+    monkeypatch.setattr(llm_gateway, "get_model", lambda model_name: model)
+    monkeypatch.setattr(llm_gateway, "_token_counts", type(llm_gateway._token_counts)())
+    return model
+
+
+def short_lease(monkeypatch, seconds):
+    monkeypatch.setattr(llm_gateway, "FLIGHT_LEASE_SECONDS", seconds)
+
+
+def following_remote(monkeypatch):
+    """Event set once a caller starts following another process's flight."""
+    following = threading.Event()
+    follow_remote = llm_gateway._follow_remote
+
+    def follow(flight_id, flight):
+        following.set()
+        return follow_remote(flight_id, flight)
+
+    monkeypatch.setattr(llm_gateway, "_follow_remote", follow)
+    return following
+
+
+def wait_until(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+# Shared state
+
+
+def test_claim_flight_returns_the_live_flight_to_later_callers(state):
+    flight_id, owned = state.claim_flight("key")
+    assert owned
+    assert state.claim_flight("key") == (flight_id, False)
+
+
+def test_claim_flight_takes_over_an_expired_lease(state, monkeypatch):
+    short_lease(monkeypatch, -1)
+    expired_id, _ = state.claim_flight("key")
+    flight_id, owned = state.claim_flight("key")
+    assert owned
+    assert flight_id != expired_id
+
+
+def test_claim_flight_starts_a_new_flight_once_the_last_one_finished(state):
+    finished_id, _ = state.claim_flight("key")
+    state.finish_flight(finished_id)
+    flight_id, owned = state.claim_flight("key")
+    assert owned
+    assert flight_id != finished_id
+
+
+def test_take_token_keeps_the_reserve_for_interactive_requests(state):
+    rate = 1 / 60.0
+    assert state.take_token(rate, 3, reserve=2) == 0
+    assert state.take_token(rate, 3, reserve=2) > 0
+    assert state.take_token(rate, 3, reserve=0) == 0
+    assert state.take_token(rate, 3, reserve=0) == 0
+    assert state.take_token(rate, 3, reserve=0) > 0
+
+
+# Following other processes
+
+
+def test_follow_remote_publishes_stored_chunks(state):
+    flight_id, _ = state.claim_flight("key")
+    state.publish_chunk(flight_id, 1, "a")
+    state.publish_chunk(flight_id, 2, "b")
+    state.finish_flight(flight_id)
+
+    flight = _Flight()
+    assert llm_gateway._follow_remote(flight_id, flight) is False
+    flight.finish()
+    assert list(flight.follow()) == ["a", "b"]
+
+
+def test_follow_remote_raises_the_owners_error(state):
+    flight_id, _ = state.claim_flight("key")
+    state.finish_flight(flight_id, RuntimeError("quota exceeded"))
+    with pytest.raises(CoalescedRequestError, match="quota exceeded"):
+        llm_gateway._follow_remote(flight_id, _Flight())
+
+
+def test_follow_remote_hands_over_when_the_owner_expires_before_sending(state, monkeypatch):
+    short_lease(monkeypatch, -1)
+    flight_id, _ = state.claim_flight("key")
+    assert llm_gateway._follow_remote(flight_id, _Flight()) is True
+
+
+def test_follow_remote_fails_when_the_owner_expires_mid_response(state, monkeypatch):
+    short_lease(monkeypatch, -1)
+    flight_id, _ = state.claim_flight("key")
+    state.publish_chunk(flight_id, 1, "partial")
+    flight = _Flight()
+    with pytest.raises(CoalescedRequestError):
+        llm_gateway._follow_remote(flight_id, flight)
+    assert flight.chunks == ["partial"]
+
+
+# Coalescing
+
+
+def test_identical_requests_share_one_call(model, limiter):
+    model.release.clear()
+    results = []
+    callers = [threading.Thread(target=lambda: results.append(llm_gateway.generate("prompt")))
+               for _ in range(5)]
+    for caller in callers:
+        caller.start()
+    wait_until(lambda: model.generate_calls == 1)
+    model.release.set()
+    for caller in callers:
+        caller.join(5)
+
+    assert results == ["response"] * 5
+    assert model.generate_calls == 1
+    assert limiter.priorities == [llm_gateway.PRIORITY_INTERACTIVE]
+
+
+def test_streamed_chunks_reach_every_caller(model):
+    model.text = "one two three"
+    model.release.clear()
+    first = llm_gateway.generate_stream("prompt")
+    assert next(first) == "one"
+    # Joins mid-stream and still gets the chunks sent so far.
+    second = llm_gateway.generate_stream("prompt")
+    assert next(second) == "one"
+    model.release.set()
+
+    assert list(first) == ["two", "three"]
+    assert list(second) == ["two", "three"]
+    assert model.generate_calls == 1
+
+
+def test_errors_reach_every_joined_caller(model, state):
+    model.error = RuntimeError("backend down")
+    model.release.clear()
+    key = llm_gateway._request_key("generate", llm_gateway.FAST_MODEL, "prompt")
+    send = lambda publish: llm_gateway._send(publish, llm_gateway.FAST_MODEL, "prompt", 0, False)
+    followers = [llm_gateway._coalesced(key, "test", send) for _ in range(3)]
+    model.release.set()
+
+    for follower in followers:
+        with pytest.raises(RuntimeError, match="backend down"):
+            list(follower)
+    assert model.generate_calls == 1
+    assert state.claim_flight(key)[1], "the failed flight should not be followed again"
+
+
+def test_requests_from_another_process_are_followed(model, state, monkeypatch):
+    following = following_remote(monkeypatch)
+    key = llm_gateway._request_key("generate", llm_gateway.FAST_MODEL, "prompt")
+    flight_id, _ = state.claim_flight(key)
+
+    result = []
+    caller = threading.Thread(target=lambda: result.append(llm_gateway.generate("prompt")))
+    caller.start()
+    assert following.wait(5)
+    state.publish_chunk(flight_id, 1, "from another process")
+    state.finish_flight(flight_id)
+    caller.join(5)
+
+    assert result == ["from another process"]
+    assert model.generate_calls == 0
+
+
+def test_remote_errors_reach_followers(model, state, monkeypatch):
+    following = following_remote(monkeypatch)
+    key = llm_gateway._request_key("generate", llm_gateway.FAST_MODEL, "prompt")
+    flight_id, _ = state.claim_flight(key)
+
+    errors = []
+
+    def call():
+        try:
+            llm_gateway.generate("prompt")
+        except CoalescedRequestError as e:
+            errors.append(str(e))
+
+    caller = threading.Thread(target=call)
+    caller.start()
+    assert following.wait(5)
+    state.finish_flight(flight_id, RuntimeError("quota exceeded"))
+    caller.join(5)
+
+    assert errors == ["quota exceeded"]
+    assert model.generate_calls == 0
+
+
+def test_abandoned_remote_request_is_taken_over(model, state, monkeypatch):
+    short_lease(monkeypatch, 0.2)
+    state.claim_flight(llm_gateway._request_key("generate", llm_gateway.FAST_MODEL, "prompt"))
+    short_lease(monkeypatch, 30)
+
+    assert llm_gateway.generate("prompt") == "response"
+    assert model.generate_calls == 1
+
+
+# Token counting
+
+
+def near_fast_limit_prompt():
+    return "x" * (llm_gateway.FAST_MAX_PROMPT_TOKENS * llm_gateway.CHARS_PER_TOKEN - 100)
+
+
+def test_count_tokens_is_only_called_near_a_limit(model):
+    assert llm_gateway.count_prompt_tokens("short prompt", llm_gateway.FAST_MODEL) == 3
+    assert model.count_calls == 0
+
+
+def test_identical_prompts_are_counted_once(model, limiter):
+    prompt = near_fast_limit_prompt()
+    model.release.clear()
+    plans = []
+    callers = [
+        threading.Thread(target=lambda: plans.append(
+            llm_gateway.plan(prompt, priority=llm_gateway.PRIORITY_BACKGROUND)))
+        for _ in range(10)
+    ]
+    for caller in callers:
+        caller.start()
+    wait_until(lambda: model.count_calls == 1)
+    model.release.set()
+    for caller in callers:
+        caller.join(5)
+    llm_gateway.plan(prompt)
+
+    assert model.count_calls == 1
+    assert limiter.priorities == [llm_gateway.PRIORITY_BACKGROUND]
+    assert len(plans) == 10
+    assert {p[0] for p in plans} == {llm_gateway.FAST_MODEL}
+
+
+def test_failed_count_falls_back_to_the_estimate(model, monkeypatch):
+    def count_tokens(prompt):
+        raise RuntimeError("count failed")
+
+    monkeypatch.setattr(model, "count_tokens", count_tokens)
+    prompt = near_fast_limit_prompt()
+    assert llm_gateway.count_prompt_tokens(prompt, llm_gateway.FAST_MODEL) == llm_gateway.estimate_tokens(prompt)
+
+
+# Rate limiter
+
+
+class ScriptedBucket:
+    """take_token() stand-in that hands out tokens only while `tokens` allows."""
+
+    def __init__(self):
+        self.tokens = 0
+        self.lock = threading.Lock()
+
+    def take_token(self, rate, capacity, reserve):
+        with self.lock:
+            if self.tokens >= 1 + reserve:
+                self.tokens -= 1
+                return 0
+            return 0.01
+
+
+def test_rate_limiter_serves_interactive_requests_first():
+    bucket = ScriptedBucket()
+    limiter = _RateLimiter(bucket, per_minute=60, burst=10)
+    served = []
+
+    def acquire(name, priority):
+        limiter.acquire(priority)
+        served.append(name)
+
+    waiters = [
+        threading.Thread(target=acquire, args=("background", llm_gateway.PRIORITY_BACKGROUND)),
+        threading.Thread(target=acquire, args=("interactive", llm_gateway.PRIORITY_INTERACTIVE)),
+    ]
+    for waiter in waiters:
+        waiter.start()
+        wait_until(lambda: len(limiter._waiters) == waiters.index(waiter) + 1)
+    with bucket.lock:
+        bucket.tokens = 10
+    for waiter in waiters:
+        waiter.join(5)
+
+    assert served == ["interactive", "background"]
+
+
+def test_rate_limiter_holds_background_requests_at_the_reserve(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "BACKGROUND_RESERVE", 2)
+    bucket = ScriptedBucket()
+    bucket.tokens = 2
+    limiter = _RateLimiter(bucket, per_minute=60, burst=10)
+
+    background = threading.Thread(target=limiter.acquire, args=(llm_gateway.PRIORITY_BACKGROUND,))
+    background.start()
+    time.sleep(0.05)
+    assert background.is_alive()
+
+    limiter.acquire(llm_gateway.PRIORITY_INTERACTIVE)
+    with bucket.lock:
+        bucket.tokens = 3
+    background.join(5)
+    assert not background.is_alive()
@@ -0,0 +1,39 @@
+"""Test setup shared by all services.
+
+common.llm_gateway configures the Gemini SDK and opens its state database at
+import time. Tests get a stand-in SDK module, so they never need credentials
+or network access, and a throwaway state database. Tests that exercise the
+gateway replace get_model() with their own stub models.
+"""
+import os
+import sys
+import tempfile
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ["GEMINI_STATE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="gemini-state-"), "gateway.db")
+
+
+class _UnusedModel:
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, stream=False):
+        raise AssertionError(f"Unexpected Gemini request to {self.model_name}")
+
+    def count_tokens(self, prompt):
+        raise AssertionError(f"Unexpected count_tokens request to {self.model_name}")
+
+
+try:
+    import google
+except ImportError:
+    google = types.ModuleType("google")
+    sys.modules["google"] = google
+
+_genai = types.ModuleType("google.generativeai")
+_genai.configure = lambda **kwargs: None
+_genai.GenerativeModel = _UnusedModel
+google.generativeai = _genai
+sys.modules["google.generativeai"] = _genai
@@ -0,0 +1,229 @@
+"""Local stand-ins for the Google APIs used by the Auto-quiz services.
+
+One Flask app serves just enough of each API for the official client
+libraries to work against it:
+
+- Gemini (REST): models/*:generateContent, :streamGenerateContent, :countTokens
+- Cloud Storage (STORAGE_EMULATOR_HOST): multipart and resumable uploads, deletes
+- Speech-to-Text v1p1beta1 (REST): speech:longrunningrecognize and operations polling
+- OAuth token endpoint for the generated service-account file
+
+Latencies are simulated and configurable through FAKE_* environment
+variables, so the load-test harness can measure the services' own overhead
+(and how it scales) without quota or cost.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, request, jsonify
+
+
+app = Flask(__name__)
+
+GEMINI_FIRST_TOKEN_SECONDS = float(os.environ.get("FAKE_GEMINI_FIRST_TOKEN_SECONDS", 0.4))
+GEMINI_TOKENS_PER_SECOND = float(os.environ.get("FAKE_GEMINI_TOKENS_PER_SECOND", 400))
+GCS_MB_PER_SECOND = float(os.environ.get("FAKE_GCS_MB_PER_SECOND", 50))
+SPEECH_SECONDS = float(os.environ.get("FAKE_SPEECH_SECONDS", 2.0))
+# Give every transcription a distinct transcript (and so a new transcript version).
+SPEECH_UNIQUE = os.environ.get("FAKE_SPEECH_UNIQUE", "0") == "1"
+
+TRANSCRIPT = (
+    "The laws of thermodynamics start with the zeroth law, which defines temperature through "
+    "thermal equilibrium. The first law states that energy is conserved: the change in internal "
+    "energy equals heat added minus work done. The second law says entropy of an isolated system "
+    "never decreases, which is why heat flows from hot to cold. The third law states that entropy "
+    "approaches a constant as temperature approaches absolute zero. Heat engines convert heat into "
+    "work and their efficiency is limited by the Carnot efficiency. Refrigerators move heat from "
+    "cold to hot by doing work. Enthalpy is useful for processes at constant pressure."
+)
+
+CHARS_PER_TOKEN = 4
+STREAM_CHUNK_CHARS = 200
+
+# Gemini FinishReason.STOP (the REST transport asks for integer enums).
+FINISH_STOP = 1
+
+operations = {}
+uploads = {}
+lock = threading.Lock()
+counter = {"transcripts": 0}
+
+
+def prompt_text(body):
+    return "".join(
+        part.get("text", "")
+        for content in body.get("contents", [])
+        for part in content.get("parts", [])
+    )
+
+
+def fake_quiz(prompt, count):
+    material = re.split(r"Summary part \d+ of \d+:", prompt)[-1]
+    words = re.findall(r"[A-Za-z]{5,}", material) or ["energy"]
+    part = re.search(r"part (\d+) of (\d+)", prompt)
+    part = part.group(1) if part else "1"
+    questions = []
+    for _ in range(count):
+        topic = random.choice(words).lower()
+        options = [f"{topic} option {i} ({uuid.uuid4().hex[:4]})" for i in range(4)]
+        questions.append({
+            "question": f"In part {part}, which statement about {topic} is correct? [{uuid.uuid4().hex[:8]}]",
+            "options": options,
+            "answer": random.choice(options),
+            "explanation": f"The summary describes {topic} this way.",
+        })
+    return "```json\n" + json.dumps(questions, indent=2) + "\n```"
+
+
+def fake_summary(prompt):
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+", prompt) if len(s) > 20]
+    body = " ".join(f"In depth: {s}" for s in sentences[:40])
+    return body or "The transcript was too short to summarize."
+
+
+def fake_completion(prompt):
+    match = re.search(r"generate (\d+) multiple choice questions", prompt)
+    if match:
+        return fake_quiz(prompt, int(match.group(1)))
+    return fake_summary(prompt)
+
+
+def response_chunk(text, last):
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if last:
+        candidate["finishReason"] = FINISH_STOP
+    return {"candidates": [candidate]}
+
+
+def generation_delay(chars):
+    return chars / CHARS_PER_TOKEN / GEMINI_TOKENS_PER_SECOND
+
+
+@app.route("/v1beta/models/<path:model_action>", methods=["POST"])
+def gemini(model_action):
+    model, _, action = model_action.partition(":")
+    body = request.get_json(force=True, silent=True) or {}
+    prompt = prompt_text(body)
+
+    if action == "countTokens":
+        return jsonify({"totalTokens": len(prompt) // CHARS_PER_TOKEN + 1})
+
+    text = fake_completion(prompt)
+
+    if action == "generateContent":
+        time.sleep(GEMINI_FIRST_TOKEN_SECONDS + generation_delay(len(text)))
+        return jsonify(response_chunk(text, last=True))
+
+    if action == "streamGenerateContent":
+        def generate():
+            time.sleep(GEMINI_FIRST_TOKEN_SECONDS)
+            pieces = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+            yield "["
+            for i, piece in enumerate(pieces):
+                time.sleep(generation_delay(len(piece)))
+                yield ("," if i else "") + json.dumps(response_chunk(piece, i == len(pieces) - 1)) + "\n"
+            yield "]"
+        return Response(generate(), mimetype="application/json")
+
+    return jsonify({"error": {"code": 404, "message": f"Unknown action {action}"}}), 404
+
+
+def gcs_object(bucket, name, size):
+    return {
+        "kind": "storage#object",
+        "bucket": bucket,
+        "name": name,
+        "size": str(size),
+        "generation": str(int(time.time() * 1000)),
+        "id": f"{bucket}/{name}",
+    }
+
+
+def gcs_transfer_delay(size):
+    time.sleep(size / (1024 * 1024) / GCS_MB_PER_SECOND)
+
+
+@app.route("/upload/storage/v1/b/<bucket>/o", methods=["POST", "PUT"])
+def gcs_upload(bucket):
+    upload_type = request.args.get("uploadType")
+    if upload_type == "multipart":
+        data = request.get_data()
+        metadata = json.loads(re.search(rb"\{.*?\}", data, re.DOTALL).group(0))
+        gcs_transfer_delay(len(data))
+        return jsonify(gcs_object(bucket, metadata.get("name") or request.args.get("name"), len(data)))
+
+    if upload_type == "resumable" and request.method == "POST":
+        metadata = request.get_json(force=True, silent=True) or {}
+        upload_id = uuid.uuid4().hex
+        with lock:
+            uploads[upload_id] = {"name": metadata.get("name") or request.args.get("name"), "size": 0}
+        location = f"{request.host_url.rstrip('/')}/upload/storage/v1/b/{bucket}/o?uploadType=resumable&upload_id={upload_id}"
+        return Response(status=200, headers={"Location": location})
+
+    if upload_type == "resumable":
+        upload = uploads.get(request.args.get("upload_id"))
+        if upload is None:
+            return jsonify({"error": "unknown upload"}), 404
+        data = request.get_data()
+        gcs_transfer_delay(len(data))
+        upload["size"] += len(data)
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+|\*)", request.headers.get("Content-Range", ""))
+        if match and match.group(3) != "*" and int(match.group(2)) + 1 < int(match.group(3)):
+            return Response(status=308, headers={"Range": f"bytes=0-{match.group(2)}"})
+        return jsonify(gcs_object(bucket, upload["name"], upload["size"]))
+
+    return jsonify({"error": f"Unsupported uploadType {upload_type}"}), 400
+
+
+@app.route("/storage/v1/b/<bucket>/o/<path:name>", methods=["DELETE"])
+def gcs_delete(bucket, name):
+    return Response(status=204)
+
+
+@app.route("/v1p1beta1/speech:longrunningrecognize", methods=["POST"])
+def speech_recognize():
+    name = uuid.uuid4().hex
+    transcript = TRANSCRIPT
+    if SPEECH_UNIQUE:
+        with lock:
+            counter["transcripts"] += 1
+            transcript += f" This is lecture number {counter['transcripts']}."
+    with lock:
+        operations[name] = {"ready_at": time.time() + SPEECH_SECONDS, "transcript": transcript}
+    return jsonify({"name": name})
+
+
+@app.route("/v1p1beta1/operations/<path:name>", methods=["GET"])
+def speech_operation(name):
+    operation = operations.get(name)
+    if operation is None:
+        return jsonify({"error": {"code": 404, "message": "Operation not found"}}), 404
+    if time.time() < operation["ready_at"]:
+        return jsonify({"name": name, "done": False})
+    return jsonify({
+        "name": name,
+        "done": True,
+        "response": {
+            "@type": "type.googleapis.com/google.cloud.speech.v1p1beta1.LongRunningRecognizeResponse",
+            "results": [{"alternatives": [{"transcript": operation["transcript"], "confidence": 0.95}]}],
+        },
+    })
+
+
+@app.route("/token", methods=["POST"])
+def token():
+    return jsonify({"access_token": "fake-token", "expires_in": 3600, "token_type": "Bearer"})
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"})
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8090)), threaded=True)
@@ -0,0 +1,415 @@
+"""Offline load test for the Auto-quiz pipeline.
+
+Brings the three services up with docker compose against the fake Google
+backends in fake_backends.py, drives the end-to-end flow with concurrent
+simulated users while more audio is transcribed alongside them, and reports
+per-stage p50/p99 latency from the services' own Prometheus histograms,
+plus client-side throughput and latency.
+
+    python loadtest/run_loadtest.py --users 20 --rounds 3
+
+Only the standard library is needed on the host (plus docker and openssl).
+"""
+import argparse
+import concurrent.futures
+import io
+import json
+import math
+import os
+import re
+import struct
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+import wave
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATED = os.path.join(ROOT, "loadtest", ".generated")
+CREDENTIALS_PATH = os.path.join(GENERATED, "gcloud.json")
+SERVICE_CREDENTIALS = os.path.join(ROOT, "services", "speech_to_text", "gcloud.json")
+
+COMPOSE = [
+    "docker", "compose", "--project-directory", ROOT,
+    "-f", os.path.join(ROOT, "docker-compose.yml"),
+    "-f", os.path.join(ROOT, "loadtest", "docker-compose.loadtest.yml"),
+]
+
+SERVICES = {
+    "speech_to_text": "http://localhost:5001",
+    "summarizer": "http://localhost:5002",
+    "quiz_engine": "http://localhost:5003",
+}
+FAKE_BACKENDS = "http://localhost:8090"
+
+STAGE_METRIC = "autoquiz_stage_duration_seconds"
+QUANTILES = (0.5, 0.99)
+
+SAMPLE_RE = re.compile(r'^(\w+)\{(.*)\}\s+(\S+)$')
+LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+# --- setup -------------------------------------------------------------------
+
+def write_credentials():
+    """Service-account file whose token_uri points at the fake OAuth endpoint."""
+    os.makedirs(GENERATED, exist_ok=True)
+    key = subprocess.run(
+        ["openssl", "genrsa", "2048"], check=True, capture_output=True, text=True
+    ).stdout
+    credentials = {
+        "type": "service_account",
+        "project_id": "autoquiz-loadtest",
+        "private_key_id": "loadtest",
+        "private_key": key,
+        "client_email": "loadtest@autoquiz-loadtest.iam.gserviceaccount.com",
+        "client_id": "0",
+        "token_uri": "http://fake_backends:8090/token",
+    }
+    with open(CREDENTIALS_PATH, "w") as f:
+        json.dump(credentials, f)
+
+
+def compose(*args):
+    subprocess.run(COMPOSE + list(args), check=True)
+
+
+def wait_for(url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=5):
+                return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+# --- HTTP helpers --------------------------------------------------------------
+
+def http(method, url, data=None, headers=None, timeout=600):
+    request = urllib.request.Request(url, data=data, method=method, headers=headers or {})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status, response.read()
+
+
+def post_json(url, payload, trace):
+    return http("POST", url, json.dumps(payload).encode(),
+                {"Content-Type": "application/json", "X-Trace-Id": trace})
+
+
+def post_form(url, fields, trace):
+    return http("POST", url, urllib.parse.urlencode(fields).encode(),
+                {"Content-Type": "application/x-www-form-urlencoded", "X-Trace-Id": trace})
+
+
+def post_file(url, field, filename, content, trace):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        "Content-Type: audio/wav\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return http("POST", url, body,
+                {"Content-Type": f"multipart/form-data; boundary={boundary}", "X-Trace-Id": trace})
+
+
+def silent_wav(seconds=5, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(struct.pack("<h", 0) * (seconds * rate))
+    return buffer.getvalue()
+
+
+# --- client-side timings ---------------------------------------------------------
+
+class Timings:
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def fail(self, name, error):
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        print(f"[LOADTEST] {name} failed: {error}")
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+# --- scenario --------------------------------------------------------------------
+
+def transcribe(timings, audio):
+    trace = uuid.uuid4().hex
+    start = time.perf_counter()
+    try:
+        _, body = post_file(SERVICES["speech_to_text"] + "/transcribe", "file", "lecture.wav", audio, trace)
+        job_id = json.loads(body)["job_id"]
+        while True:
+            _, body = http("GET", f"{SERVICES['speech_to_text']}/status/{job_id}")
+            status = json.loads(body)
+            if status.get("status") == "done":
+                break
+            if status.get("status") == "error":
+                raise RuntimeError(status.get("error"))
+            time.sleep(0.5)
+    except Exception as e:
+        timings.fail("transcribe", e)
+        return
+    timings.add("transcribe", time.perf_counter() - start)
+
+
+def stream_quiz(trace):
+    """POST /quiz/stream; returns (first question seconds, total seconds, quiz_id, questions)."""
+    start = time.perf_counter()
+    first = None
+    questions = []
+    request = urllib.request.Request(SERVICES["quiz_engine"] + "/quiz/stream", data=b"",
+                                     method="POST", headers={"X-Trace-Id": trace})
+    with urllib.request.urlopen(request, timeout=600) as response:
+        for line in response:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event["type"] == "question":
+                if first is None:
+                    first = time.perf_counter() - start
+                questions.append(event)
+            elif event["type"] == "done":
+                return first, time.perf_counter() - start, event["quiz_id"], questions
+            elif event["type"] == "error":
+                raise RuntimeError(event["message"])
+    raise RuntimeError("Quiz stream ended without a done event")
+
+
+def user_session(timings):
+    trace = uuid.uuid4().hex
+
+    start = time.perf_counter()
+    try:
+        post_json(SERVICES["summarizer"] + "/api/summary", {}, trace)
+        timings.add("summary", time.perf_counter() - start)
+    except Exception as e:
+        timings.fail("summary", e)
+        return None
+
+    try:
+        first, total, quiz_id, questions = stream_quiz(trace)
+        timings.add("quiz_first_question", first)
+        timings.add("quiz_total", total)
+    except Exception as e:
+        timings.fail("quiz", e)
+        return None
+
+    fields = {"quiz_id": quiz_id}
+    for q in questions:
+        fields[f"q{q['index']}"] = str(hash((trace, q["index"])) % len(q["options"]))
+    start = time.perf_counter()
+    try:
+        post_form(SERVICES["quiz_engine"] + "/submit", fields, trace)
+        timings.add("submit", time.perf_counter() - start)
+    except Exception as e:
+        timings.fail("submit", e)
+    return quiz_id, questions
+
+
+def bulk_grade(timings, quiz_id, questions, students):
+    submissions = [
+        {
+            "student_id": f"s{i}",
+            "answers": [(i * 7 + q["index"]) % len(q["options"]) for q in questions],
+        }
+        for i in range(students)
+    ]
+    start = time.perf_counter()
+    try:
+        post_json(f"{SERVICES['quiz_engine']}/api/quizzes/{quiz_id}/grade",
+                  {"submissions": submissions}, uuid.uuid4().hex)
+        timings.add("bulk_grade", time.perf_counter() - start)
+    except Exception as e:
+        timings.fail("bulk_grade", e)
+
+
+# --- server-side histograms ------------------------------------------------------
+
+def scrape_stages():
+    """{(service, stage): {le: cumulative count}} for ok outcomes, summed over services."""
+    histograms = {}
+    for service, base in SERVICES.items():
+        try:
+            _, body = http("GET", base + "/metrics", timeout=30)
+        except Exception as e:
+            print(f"[LOADTEST] Could not scrape {service}: {e}")
+            continue
+        for line in body.decode().splitlines():
+            match = SAMPLE_RE.match(line)
+            if not match or match.group(1) != STAGE_METRIC + "_bucket":
+                continue
+            labels = dict(LABEL_RE.findall(match.group(2)))
+            if labels.get("outcome") != "ok":
+                continue
+            buckets = histograms.setdefault((labels["service"], labels["stage"]), {})
+            le = float(labels["le"])
+            buckets[le] = buckets.get(le, 0) + float(match.group(3))
+    return histograms
+
+
+def histogram_quantile(buckets, q):
+    """Linear interpolation within the bucket holding the q-th observation (as Prometheus does)."""
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]] if bounds else 0
+    if total <= 0:
+        return float("nan")
+    rank = q * total
+    lower, below = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if math.isinf(bound):
+                return lower
+            if count == below:
+                return bound
+            return lower + (bound - lower) * (rank - below) / (count - below)
+        lower, below = bound, count
+    return lower
+
+
+def stage_report(before, after):
+    rows = []
+    for key, buckets in sorted(after.items()):
+        previous = before.get(key, {})
+        delta = {le: count - previous.get(le, 0) for le, count in buckets.items()}
+        observations = delta.get(float("inf"), 0)
+        if observations <= 0:
+            continue
+        rows.append((key[0], key[1], int(observations),
+                     *(histogram_quantile(delta, q) for q in QUANTILES)))
+    return rows
+
+
+# --- main --------------------------------------------------------------------------
+
+def run(args):
+    timings = Timings()
+    audio = silent_wav()
+
+    # Scrape first, so the transcription stages (ffmpeg, GCS upload, Speech) are in the report.
+    before = scrape_stages()
+    print("[LOADTEST] Transcribing the seed file...")
+    transcribe(timings, audio)
+    if "transcribe" not in timings.samples:
+        raise RuntimeError("The seed transcription failed; nothing to summarize")
+
+    print(f"[LOADTEST] {args.users} users x {args.rounds} rounds, "
+          f"{args.transcriptions} concurrent transcriptions...")
+    transcriptions = concurrent.futures.ThreadPoolExecutor(max(1, args.transcriptions))
+    pending = [transcriptions.submit(transcribe, timings, audio) for _ in range(args.transcriptions)]
+    start = time.perf_counter()
+    quizzes = []
+    with concurrent.futures.ThreadPoolExecutor(args.users) as pool:
+        for round_number in range(args.rounds):
+            results = list(pool.map(lambda _: user_session(timings), range(args.users)))
+            quizzes.extend(r for r in results if r)
+            print(f"[LOADTEST] Round {round_number + 1}/{args.rounds} done")
+    elapsed = time.perf_counter() - start
+    concurrent.futures.wait(pending)
+    transcriptions.shutdown()
+
+    if quizzes:
+        bulk_grade(timings, *quizzes[-1], students=args.students)
+    after = scrape_stages()
+
+    sessions = args.users * args.rounds
+    print()
+    print(f"Client: {len(quizzes)}/{sessions} sessions in {elapsed:.1f}s "
+          f"({len(quizzes) / elapsed:.2f} sessions/s)")
+    print(f"{'step':<22}{'n':>6}{'p50 s':>10}{'p99 s':>10}{'errors':>8}")
+    for name in ("transcribe", "summary", "quiz_first_question", "quiz_total", "submit", "bulk_grade"):
+        values = timings.samples.get(name, [])
+        print(f"{name:<22}{len(values):>6}{percentile(values, 0.5):>10.3f}"
+              f"{percentile(values, 0.99):>10.3f}{timings.errors.get(name, 0):>8}")
+
+    print()
+    print("Server stages (from /metrics, this run only):")
+    print(f"{'service':<16}{'stage':<26}{'n':>6}{'p50 s':>10}{'p99 s':>10}")
+    for service, stage, n, p50, p99 in stage_report(before, after):
+        print(f"{service:<16}{stage:<26}{n:>6}{p50:>10.3f}{p99:>10.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "elapsed_seconds": elapsed,
+                "sessions": sessions,
+                "completed": len(quizzes),
+                "client": {
+                    name: {"n": len(values), "p50": percentile(values, 0.5), "p99": percentile(values, 0.99)}
+                    for name, values in timings.samples.items()
+                },
+                "errors": timings.errors,
+                "stages": [
+                    {"service": s, "stage": st, "n": n, "p50": p50, "p99": p99}
+                    for s, st, n, p50, p99 in stage_report(before, after)
+                ],
+            }, f, indent=2)
+        print(f"\n[LOADTEST] Report written to {args.output}")
+
+    return 0 if not timings.errors else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--rounds", type=int, default=3, help="sessions per user")
+    parser.add_argument("--transcriptions", type=int, default=4,
+                        help="transcriptions running concurrently with the user sessions")
+    parser.add_argument("--students", type=int, default=500, help="submissions in the bulk grading call")
+    parser.add_argument("--output", help="also write the report as JSON")
+    parser.add_argument("--no-compose", action="store_true",
+                        help="use services that are already running (started with the loadtest overlay)")
+    parser.add_argument("--keep", action="store_true", help="leave the stack running afterwards")
+    parser.add_argument("--startup-timeout", type=int, default=300)
+    args = parser.parse_args()
+
+    created_placeholder = False
+    if not args.no_compose:
+        write_credentials()
+        # The speech_to_text image copies gcloud.json at build time.
+        if not os.path.exists(SERVICE_CREDENTIALS):
+            with open(CREDENTIALS_PATH) as src, open(SERVICE_CREDENTIALS, "w") as dst:
+                dst.write(src.read())
+            created_placeholder = True
+        compose("up", "-d", "--build")
+
+    try:
+        wait_for(FAKE_BACKENDS + "/healthz", args.startup_timeout)
+        for base in SERVICES.values():
+            wait_for(base + "/metrics", args.startup_timeout)
+        return run(args)
+    finally:
+        if created_placeholder:
+            os.remove(SERVICE_CREDENTIALS)
+        if not args.no_compose and not args.keep:
+            compose("down", "-v")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,103 +1,227 @@
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, Response, stream_with_context, jsonify
 import requests
-import google.generativeai as genai
 import json
-import re
 from collections import OrderedDict
 import os
+import threading
+import time
 
-app = Flask(__name__)
-
+import item_analysis
+from common import metrics
+import quiz_generator
+from question_bank import QuestionBank
+from quiz_store import QuizStore, grade
 
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-
-genai.configure(api_key=GEMINI_API_KEY)
+app = Flask(__name__)
+metrics.init_app(app, "quiz_engine")
+
+QUIZ_QUESTION_COUNT = 20
+MAX_BULK_SUBMISSIONS = 20000
+
+SPEECH_TO_TEXT_URL = os.environ.get("SPEECH_TO_TEXT_URL", "http://40.90.194.113:5001")
+SUMMARIZER_URL = os.environ.get("SUMMARIZER_URL", "http://40.90.194.113:5002")
+
+SPEECH_TRANSCRIPT_VERSION_API = f"{SPEECH_TO_TEXT_URL}/latest_transcript_version"
+SUMMARIZER_ENSURE_API = f"{SUMMARIZER_URL}/api/summary"
+SUMMARIZER_LATEST_API = f"{SUMMARIZER_URL}/latest_summary"
+# Quizzes are always built from the default-prompt summary, never a custom one.
+SUMMARY_PROMPT_KEY = "default"
+
+question_bank = QuestionBank()
+quiz_store = QuizStore()
+
+# transcript_version -> (etag, summary), revalidated with If-None-Match.
+MAX_CACHED_SUMMARIES = 32
+summary_cache = OrderedDict()
+summary_cache_lock = threading.Lock()
+
+
+class SummaryUnavailable(Exception):
+    pass
+
+
+def json_object(res, source):
+    """JSON object body of a response, or SummaryUnavailable if it is not one."""
+    try:
+        data = res.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        raise SummaryUnavailable(f"Malformed response from {source}: {res.text[:200]}")
+    return data
+
+
+def fetch_summary():
+    """Return (transcript_version, summary) for the latest transcript.
+
+    Reuses the summarizer's stored default-prompt summary for the current
+    transcript version and only asks it to summarize when none exists yet.
+    """
+    with metrics.stage("fetch_transcript_version"):
+        res = requests.get(SPEECH_TRANSCRIPT_VERSION_API, headers=metrics.trace_headers(), timeout=10)
+    if res.status_code != 200:
+        raise SummaryUnavailable(f"Error fetching transcript version: {res.text}")
+    transcript_version = json_object(res, "speech_to_text").get("transcript_version")
+    if not isinstance(transcript_version, str) or not transcript_version:
+        raise SummaryUnavailable("speech_to_text returned no transcript version.")
+
+    with summary_cache_lock:
+        cached = summary_cache.get(transcript_version)
+    headers = metrics.trace_headers()
+    if cached:
+        headers["If-None-Match"] = cached[0]
+    with metrics.stage("fetch_summary"):
+        res = requests.get(SUMMARIZER_LATEST_API,
+                           params={"transcript_version": transcript_version, "prompt": SUMMARY_PROMPT_KEY},
+                           headers=headers, timeout=10)
+    if res.status_code == 304 and cached:
+        metrics.count("summary_not_modified")
+        return transcript_version, cached[1]
+
+    if res.status_code == 200:
+        data = json_object(res, "summarizer")
+        etag = res.headers.get("ETag")
+        summary = data.get("summary")
+    elif res.status_code == 404:
+        print(f"[QUIZ] No summary for transcript {transcript_version}, requesting one")
+        metrics.count("summary_missing")
+        with metrics.stage("ensure_summary"):
+            res = requests.post(SUMMARIZER_ENSURE_API, headers=metrics.trace_headers(), timeout=600)
+        if res.status_code != 200:
+            raise SummaryUnavailable(f"Error fetching summary: {res.text}")
+        data = json_object(res, "summarizer")
+        # The transcript may have changed between the two calls.
+        transcript_version = data.get("transcript_version")
+        if not isinstance(transcript_version, str) or not transcript_version:
+            raise SummaryUnavailable("Summarizer returned no transcript version.")
+        etag = None
+        summary = data.get("summary")
+    else:
+        raise SummaryUnavailable(f"Error fetching summary: {res.text}")
+
+    if data.get("prompt_key", SUMMARY_PROMPT_KEY) != SUMMARY_PROMPT_KEY:
+        raise SummaryUnavailable("Summarizer returned a custom-prompt summary.")
+    if not summary:
+        raise SummaryUnavailable("No summary received from summarizer.")
+    if etag:
+        with summary_cache_lock:
+            summary_cache[transcript_version] = (etag, summary)
+            summary_cache.move_to_end(transcript_version)
+            while len(summary_cache) > MAX_CACHED_SUMMARIES:
+                summary_cache.popitem(last=False)
+    return transcript_version, summary
 
-SUMMARIZER_GENERATE_API = "http://40.90.194.113:5002/"
-SUMMARIZER_LATEST_API = "http://40.90.194.113:5002/latest_summary"
 
 @app.route("/", methods=["GET", "POST"])
 def quiz_home():
     if request.method == "POST":
         try:
-            requests.post(SUMMARIZER_GENERATE_API)
-            res = requests.get(SUMMARIZER_LATEST_API)
-
-            if res.status_code != 200:
-                return f"<h3>Error fetching summary: {res.text}</h3>"
-
-            summary = res.json().get("summary")
-            if not summary:
-                return "<h3>No summary received from summarizer.</h3>"
-
-            prompt = f"""
-            Based on the following summary, generate 20 multiple choice questions.
-            Each should include:
-            - question (string)
-            - options (list of 4 strings)
-            - answer (correct option as text)
-            - explanation (why this answer is correct)
-            Format response as JSON list.
-
-            Summary:
-            {summary}
-            """
-
-            model = genai.GenerativeModel("gemini-1.5-pro-latest")
-            response = model.generate_content(prompt)
-
-            raw_text = response.text.strip()
-            cleaned_text = re.sub(r"^```json\s*|```$", "", raw_text, flags=re.DOTALL).strip()
+            try:
+                transcript_version, summary = fetch_summary()
+            except SummaryUnavailable as e:
+                return f"<h3>{e}</h3>"
 
             try:
-                quiz_raw = json.loads(cleaned_text)
-            except json.JSONDecodeError:
-                # Try to extract the JSON from the text manually
-                json_match = re.search(r"\[.*\]", cleaned_text, re.DOTALL)
-                if json_match:
-                    quiz_raw = json.loads(json_match.group(0))
-                else:
-                    return f"<h3>Invalid JSON received from Gemini: <pre>{cleaned_text}</pre></h3>"
-
-            quiz_data = []
-            for q in quiz_raw:
-                quiz_data.append({
-                    "question": q.get("question"),
-                    "options": q.get("options"),
-                    "answer": q.get("answer"),
-                    "explanation": q.get("explanation")
-                })
-
-            app.config["QUIZ_DATA"] = quiz_data
-            return render_template("quiz.html", quiz=quiz_data)
+                with metrics.stage("quiz_assemble"):
+                    quiz_data = question_bank.get_quiz(transcript_version, summary, QUIZ_QUESTION_COUNT)
+            except quiz_generator.QuizGenerationError as e:
+                return f"<h3>{e}</h3>"
+
+            quiz_id = quiz_store.save(quiz_data)
+            return render_template("quiz.html", quiz=quiz_data, quiz_id=quiz_id)
 
         except Exception as e:
             return f"<h3>Error generating quiz: {str(e)}</h3>"
 
     return render_template("quiz.html", quiz=None)
 
+@app.route("/quiz/stream", methods=["POST"])
+def quiz_stream():
+    """Stream the quiz as NDJSON, one line per question as soon as it is available.
+
+    Answers and explanations stay on the server; the page renders questions
+    progressively and posts the finished form to /submit.
+    """
+    try:
+        transcript_version, summary = fetch_summary()
+    except (SummaryUnavailable, requests.RequestException) as e:
+        return Response(json.dumps({"type": "error", "message": str(e)}) + "\n",
+                        mimetype="application/x-ndjson")
+
+    def generate():
+        quiz_data = []
+        start = time.perf_counter()
+        try:
+            for q in question_bank.stream_quiz(transcript_version, summary, QUIZ_QUESTION_COUNT):
+                if not quiz_data:
+                    metrics.observe("quiz_first_question", time.perf_counter() - start)
+                yield json.dumps({
+                    "type": "question",
+                    "index": len(quiz_data),
+                    "question": q["question"],
+                    "options": q["options"],
+                }) + "\n"
+                quiz_data.append(q)
+        except Exception as e:
+            metrics.observe("quiz_assemble", time.perf_counter() - start, "error")
+            yield json.dumps({"type": "error", "message": f"Error generating quiz: {e}"}) + "\n"
+            return
+        metrics.observe("quiz_assemble", time.perf_counter() - start)
+        quiz_id = quiz_store.save(quiz_data)
+        yield json.dumps({"type": "done", "total": len(quiz_data), "quiz_id": quiz_id}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                    headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
+
+def parse_selection(value, option_count):
+    """Option index posted for a question, or None if missing or out of range."""
+    try:
+        index = int(value)
+    except (TypeError, ValueError):
+        return None
+    return index if 0 <= index < option_count else None
+
 @app.route("/submit", methods=["POST"])
 def submit_quiz():
-    quiz_data = app.config.get("QUIZ_DATA", [])
-    total = len(quiz_data)
-    score = 0
-    analysis = []
-
-    for i in range(total):
-        q = quiz_data[i]
-        user_answer = request.form.get(f"q{i}")
-        is_correct = user_answer == q["answer"]
-        if is_correct:
-            score += 1
-        analysis.append({
-            "question": q["question"],
-            "selected": user_answer,
-            "correct": q["answer"],
-            "is_correct": is_correct,
-            "explanation": q["explanation"]
-        })
-
-    return render_template("result.html", score=score, total=total, analysis=analysis)
+    quiz = quiz_store.load(request.form.get("quiz_id", ""))
+    if quiz is None:
+        return "<h3>This quiz has expired or does not exist. Please generate a new quiz.</h3>", 404
+
+    selections = [
+        parse_selection(request.form.get(f"q{i}"), len(q["options"]))
+        for i, q in enumerate(quiz.questions)
+    ]
+    with metrics.stage("grade"):
+        score, analysis = grade(quiz, selections)
+    return render_template("result.html", score=score, total=len(quiz.questions), analysis=analysis)
+
+@app.route("/api/quizzes/<quiz_id>/grade", methods=["POST"])
+def grade_class_submissions(quiz_id):
+    """Grade a whole class in one call.
+
+    Body: {"submissions": [{"student_id": "...", "answers": [...]}, ...]} where
+    each answer is an option index (number or digit string), the option
+    text, or null. Returns per-student scores plus per-question difficulty,
+    discrimination index and distractor frequencies.
+    """
+    quiz = quiz_store.load(quiz_id)
+    if quiz is None:
+        return jsonify({"error": "Quiz not found or expired"}), 404
+
+    payload = request.get_json(silent=True)
+    submissions = payload.get("submissions") if isinstance(payload, dict) else None
+    if not isinstance(submissions, list):
+        return jsonify({"error": "Expected a JSON body with a list of submissions"}), 400
+    if len(submissions) > MAX_BULK_SUBMISSIONS:
+        return jsonify({"error": f"At most {MAX_BULK_SUBMISSIONS} submissions per request"}), 413
+    for i, submission in enumerate(submissions):
+        error = item_analysis.submission_error(submission)
+        if error:
+            return jsonify({"error": f"Submission {i}: {error}"}), 400
+
+    with metrics.stage("bulk_grade"):
+        result = item_analysis.grade_class(quiz, submissions)
+    return jsonify(result)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0",port=5003, debug=True)
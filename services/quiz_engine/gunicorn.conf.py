@@ -0,0 +1,23 @@
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+
+bind = "0.0.0.0:5003"
+workers = 4
+threads = 8
+timeout = 600
+
+
+def on_starting(server):
+    # Metrics files left by a previous run would be added to the new counts.
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,131 @@
+"""Bulk grading and classical item analysis for one quiz.
+
+A class's submissions are turned into a students x questions matrix of
+chosen option indices (-1 = unanswered) and graded with array operations
+against the quiz's answer key.
+"""
+import numpy as np
+
+
+UNANSWERED = -1
+# Share of students in the upper and lower groups of the discrimination index.
+DISCRIMINATION_GROUP = 0.27
+
+
+def selection_index(answer, options, option_lookup):
+    """Option index for one posted answer: an index, a digit string, the option text, or None.
+
+    Digit strings are read as indices, the way the quiz form posts them.
+    """
+    if answer is None or isinstance(answer, bool):
+        return UNANSWERED
+    if isinstance(answer, str) and answer.strip().isdigit():
+        answer = int(answer)
+    if isinstance(answer, int):
+        return answer if 0 <= answer < len(options) else UNANSWERED
+    if not isinstance(answer, str):
+        return UNANSWERED
+    return option_lookup.get(answer.strip(), UNANSWERED)
+
+
+def submission_error(submission):
+    """Why a posted submission cannot be graded, or None if it is well-formed."""
+    if not isinstance(submission, dict):
+        return "each submission must be an object"
+    answers = submission.get("answers")
+    if answers is not None and not isinstance(answers, list):
+        return "answers must be a list"
+    return None
+
+
+def response_matrix(quiz, submissions):
+    """int8 matrix of selected option indices, one row per submission."""
+    lookups = [{option: i for i, option in enumerate(q["options"])} for q in quiz.questions]
+    question_count = len(quiz.questions)
+    rows = []
+    for submission in submissions:
+        answers = (submission.get("answers") or [])[:question_count]
+        answers += [None] * (question_count - len(answers))
+        rows.append([
+            selection_index(answer, q["options"], lookup)
+            for answer, q, lookup in zip(answers, quiz.questions, lookups)
+        ])
+    return np.array(rows, dtype=np.int8).reshape(len(rows), question_count)
+
+
+def analyze(quiz, responses):
+    """Grade a response matrix and compute per-question statistics.
+
+    Returns (scores, difficulty, discrimination, option_counts):
+    scores         - correct answers per student
+    difficulty     - share of students answering each question correctly
+    discrimination - upper-group minus lower-group difficulty per question
+    option_counts  - questions x (options + 1) counts, last column unanswered
+    """
+    student_count, question_count = responses.shape
+    key = np.frombuffer(quiz.answer_key, dtype=np.uint8).astype(np.int8)
+    correct = responses == key
+
+    scores = correct.sum(axis=1)
+    if student_count:
+        difficulty = correct.mean(axis=0)
+    else:
+        difficulty = np.zeros(question_count)
+
+    group = max(1, int(round(student_count * DISCRIMINATION_GROUP)))
+    if student_count >= 2:
+        order = np.argsort(scores, kind="stable")
+        discrimination = correct[order[-group:]].mean(axis=0) - correct[order[:group]].mean(axis=0)
+    else:
+        discrimination = np.zeros(question_count)
+
+    # One bincount over (question, option) cells; unanswered maps to the last column.
+    option_slots = max((len(q["options"]) for q in quiz.questions), default=0) + 1
+    slots = np.where(responses == UNANSWERED, option_slots - 1, responses).astype(np.int64)
+    cells = slots + np.arange(question_count) * option_slots
+    option_counts = np.bincount(cells.ravel(), minlength=question_count * option_slots)
+    option_counts = option_counts.reshape(question_count, option_slots)
+
+    return scores, difficulty, discrimination, option_counts
+
+
+def grade_class(quiz, submissions):
+    """JSON-ready per-student scores and per-question item analysis."""
+    responses = response_matrix(quiz, submissions)
+    scores, difficulty, discrimination, option_counts = analyze(quiz, responses)
+    question_count = len(quiz.questions)
+
+    students = [
+        {
+            "student_id": submission.get("student_id", str(i)),
+            "score": int(score),
+            "total": question_count,
+        }
+        for i, (submission, score) in enumerate(zip(submissions, scores.tolist()))
+    ]
+
+    questions = []
+    for i, q in enumerate(quiz.questions):
+        counts = option_counts[i].tolist()
+        correct_index = quiz.answer_key[i]
+        questions.append({
+            "index": i,
+            "question": q["question"],
+            "correct_option": q["options"][correct_index],
+            "difficulty": round(float(difficulty[i]), 4),
+            "discrimination": round(float(discrimination[i]), 4),
+            "option_counts": {option: counts[j] for j, option in enumerate(q["options"])},
+            "distractors": {
+                option: counts[j] for j, option in enumerate(q["options"]) if j != correct_index
+            },
+            "unanswered": counts[-1],
+        })
+
+    summary = {"students": len(students)}
+    if students:
+        summary.update({
+            "mean": round(float(scores.mean()), 4),
+            "median": float(np.median(scores)),
+            "std": round(float(scores.std()), 4),
+        })
+    return {"quiz_id": quiz.quiz_id, "summary": summary, "students": students, "questions": questions}
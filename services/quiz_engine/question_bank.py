@@ -0,0 +1,350 @@
+"""Persistent question bank keyed by transcript version.
+
+Questions are generated in batches, stored in SQLite and reused: each quiz is
+a random sample from the pool for its transcript version, so serving a quiz
+needs no Gemini call once the pool is filled. Pools are filled by one
+background thread per transcript version; requests that arrive while a pool
+is still too small follow that fill and receive its questions as they are
+generated. Pools below BANK_MIN_POOL are topped up the same way.
+
+Fills are claimed in the database, so only one worker process fills a pool
+at a time. Other workers follow the fill by polling for the questions it
+stores, and take it over if its owner stops renewing the lease.
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from common import llm_gateway
+from common import metrics
+import quiz_generator
+
+
+QUESTION_BANK_PATH = os.environ.get("QUESTION_BANK_PATH", "question_bank.db")
+
+BANK_BATCH_SIZE = 40
+BANK_BATCH_SHARDS = 8
+BANK_MIN_POOL = 60
+BANK_TARGET_POOL = 120
+
+# A fill's claim expires unless its owner renews it; followers poll for its questions.
+FILL_LEASE_SECONDS = 30
+FILL_POLL_SECONDS = 0.25
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    transcript_version TEXT NOT NULL,
+    dedup_key TEXT NOT NULL,
+    question TEXT NOT NULL,
+    options TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    explanation TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    UNIQUE (transcript_version, dedup_key)
+)
+"""
+FILLS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fills (
+    transcript_version TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    lease_until REAL NOT NULL
+)
+"""
+
+
+class _Fill:
+    """Questions added by one running fill, readable by any number of followers."""
+
+    def __init__(self):
+        self.questions = []
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def publish(self, question):
+        with self._cond:
+            self.questions.append(question)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def follow(self):
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.questions) and not self.done:
+                    self._cond.wait()
+                batch = self.questions[index:]
+                index = len(self.questions)
+                if not batch:
+                    return
+            yield from batch
+
+
+class QuestionBank:
+
+    def __init__(self, path=QUESTION_BANK_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(SCHEMA)
+            conn.execute(FILLS_SCHEMA)
+        self._owner = uuid.uuid4().hex
+        self._fills = {}
+        self._fills_lock = threading.Lock()
+
+    def _connect(self):
+        # One connection per call: sqlite3 connections are not shared across threads.
+        return sqlite3.connect(self.path, timeout=30)
+
+    def add(self, transcript_version, questions):
+        """Store questions, skipping ones already in the pool. Returns the number added."""
+        now = time.time()
+        rows = [
+            (transcript_version, quiz_generator.dedup_key(q), q["question"],
+             json.dumps(q["options"]), q["answer"], q["explanation"], now)
+            for q in questions
+        ]
+        with self._connect() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO questions "
+                "(transcript_version, dedup_key, question, options, answer, explanation, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            return conn.total_changes - before
+
+    def count(self, transcript_version):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM questions WHERE transcript_version = ?", (transcript_version,)
+            ).fetchone()
+        return row[0]
+
+    def sample(self, transcript_version, n):
+        """Random quiz of up to n questions, with options shuffled per quiz."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT question, options, answer, explanation FROM questions "
+                "WHERE transcript_version = ? ORDER BY RANDOM() LIMIT ?",
+                (transcript_version, n),
+            ).fetchall()
+        quiz_data = []
+        for question, options, answer, explanation in rows:
+            options = json.loads(options)
+            random.shuffle(options)
+            quiz_data.append({
+                "question": question,
+                "options": options,
+                "answer": answer,
+                "explanation": explanation,
+            })
+        return quiz_data
+
+    def pool_questions(self, transcript_version):
+        """Question texts already in the pool, for duplicate checks."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT question FROM questions WHERE transcript_version = ?", (transcript_version,)
+            ).fetchall()
+        return [{"question": row[0]} for row in rows]
+
+    def _questions_after(self, transcript_version, last_id):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, question, options, answer, explanation FROM questions "
+                "WHERE transcript_version = ? AND id > ? ORDER BY id",
+                (transcript_version, last_id),
+            ).fetchall()
+        return [
+            (row_id, {"question": question, "options": json.loads(options),
+                      "answer": answer, "explanation": explanation})
+            for row_id, question, options, answer, explanation in rows
+        ]
+
+    def _last_question_id(self, transcript_version):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT MAX(id) FROM questions WHERE transcript_version = ?", (transcript_version,)
+            ).fetchone()
+        return row[0] or 0
+
+    def _claim_fill(self, transcript_version):
+        """Claim the fill for a pool unless another process holds a live lease on it."""
+        now = time.time()
+        with self._connect() as conn:
+            before = conn.total_changes
+            conn.execute(
+                "INSERT OR IGNORE INTO fills (transcript_version, owner, lease_until) VALUES (?, ?, ?)",
+                (transcript_version, self._owner, now + FILL_LEASE_SECONDS),
+            )
+            conn.execute(
+                "UPDATE fills SET owner = ?, lease_until = ? WHERE transcript_version = ? AND lease_until < ?",
+                (self._owner, now + FILL_LEASE_SECONDS, transcript_version, now),
+            )
+            return conn.total_changes > before
+
+    def _renew_fill(self, transcript_version):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE fills SET lease_until = ? WHERE transcript_version = ? AND owner = ?",
+                (time.time() + FILL_LEASE_SECONDS, transcript_version, self._owner),
+            )
+
+    def _release_fill(self, transcript_version):
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM fills WHERE transcript_version = ? AND owner = ?",
+                (transcript_version, self._owner),
+            )
+
+    def _fill_lease(self, transcript_version):
+        """Lease expiry of the running fill for a pool, or None if there is none."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT lease_until FROM fills WHERE transcript_version = ?", (transcript_version,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _generate_fill(self, transcript_version, summary, fill, interactive_questions):
+        pool = quiz_generator.DuplicateFilter(self.pool_questions(transcript_version))
+        count = self.count(transcript_version)
+        question_set = count // BANK_BATCH_SIZE
+        while count < BANK_TARGET_POOL:
+            question_set += 1
+            # Once a waiting request can be served, the rest of the fill is background work.
+            if count < interactive_questions:
+                priority = llm_gateway.PRIORITY_INTERACTIVE
+            else:
+                priority = llm_gateway.PRIORITY_BACKGROUND
+            added = 0
+            with metrics.stage("bank_fill_batch"):
+                # Shards oversample to absorb duplicates; the bank keeps every distinct question they return.
+                for q in quiz_generator.stream_quiz(summary, BANK_BATCH_SIZE, BANK_BATCH_SHARDS, priority,
+                                                    question_set, keep_extra=True):
+                    # Near-duplicates of questions from earlier batches stay out of the pool.
+                    if pool.add(q) and self.add(transcript_version, [q]):
+                        added += 1
+                        fill.publish(q)
+            metrics.count("bank_questions_added", added)
+            count += added
+            print(f"[BANK] Added {added} questions for transcript {transcript_version} (pool: {count})")
+            if added == 0:
+                break
+
+    def _follow_remote_fill(self, transcript_version, fill, last_id):
+        """Publish questions stored by another process's fill until it ends.
+
+        Returns True if the other fill's lease expired and this process took
+        the fill over.
+        """
+        while True:
+            lease_until = self._fill_lease(transcript_version)
+            rows = self._questions_after(transcript_version, last_id)
+            for last_id, q in rows:
+                fill.publish(q)
+            if rows:
+                continue
+            if lease_until is None:
+                return False
+            if lease_until < time.time() and self._claim_fill(transcript_version):
+                print(f"[BANK] Took over the expired fill for transcript {transcript_version}")
+                return True
+            time.sleep(FILL_POLL_SECONDS)
+
+    def _run_fill(self, transcript_version, summary, fill, interactive_questions, owned, last_id):
+        error = None
+        heartbeat = None
+        try:
+            if not owned:
+                owned = self._follow_remote_fill(transcript_version, fill, last_id)
+            if owned:
+                heartbeat = threading.Event()
+                threading.Thread(
+                    target=self._keep_lease, args=(transcript_version, heartbeat), daemon=True
+                ).start()
+                self._generate_fill(transcript_version, summary, fill, interactive_questions)
+        except Exception as e:
+            error = e
+            print(f"[BANK] Fill for transcript {transcript_version} failed: {e}")
+        finally:
+            if heartbeat is not None:
+                heartbeat.set()
+            if owned:
+                self._release_fill(transcript_version)
+            with self._fills_lock:
+                self._fills.pop(transcript_version, None)
+            fill.finish(error)
+
+    def _keep_lease(self, transcript_version, stopped):
+        while not stopped.wait(FILL_LEASE_SECONDS / 3):
+            try:
+                self._renew_fill(transcript_version)
+            except sqlite3.Error as e:
+                print(f"[BANK] Could not renew fill lease for transcript {transcript_version}: {e}")
+
+    def start_fill(self, transcript_version, summary, interactive_questions=0):
+        """Start filling a pool up to BANK_TARGET_POOL, or return the fill already running.
+
+        If another process holds the fill, the returned fill follows it
+        instead. Batches run at PRIORITY_INTERACTIVE while the pool holds
+        fewer than `interactive_questions` (the size of quiz a request is
+        waiting for) and at PRIORITY_BACKGROUND after that, so top-ups queue
+        behind interactive Gemini requests.
+        """
+        with self._fills_lock:
+            fill = self._fills.get(transcript_version)
+            if fill is None:
+                fill = _Fill()
+                self._fills[transcript_version] = fill
+                last_id = self._last_question_id(transcript_version)
+                owned = self._claim_fill(transcript_version)
+                if not owned:
+                    metrics.count("bank_fill_followed")
+                threading.Thread(
+                    target=metrics.in_current_trace(self._run_fill),
+                    args=(transcript_version, summary, fill, interactive_questions, owned, last_id),
+                    daemon=True
+                ).start()
+        return fill
+
+    def stream_quiz(self, transcript_version, summary, n):
+        """Yield a quiz of up to n questions, generating only when the pool is too small."""
+        count = self.count(transcript_version)
+        if count >= n:
+            metrics.count("bank_hit")
+            if count < BANK_MIN_POOL:
+                self.start_fill(transcript_version, summary)
+            yield from self.sample(transcript_version, n)
+            return
+
+        metrics.count("bank_miss")
+        fill = self.start_fill(transcript_version, summary, n)
+        quiz_data = self.sample(transcript_version, n)
+        seen = quiz_generator.DuplicateFilter(quiz_data)
+        yield from quiz_data
+        for q in fill.follow():
+            if not seen.add(q):
+                continue
+            yield dict(q, options=random.sample(q["options"], len(q["options"])))
+            if len(seen) >= n:
+                return
+
+        if not seen:
+            raise quiz_generator.QuizGenerationError(f"Could not generate questions: {fill.error}")
+
+    def get_quiz(self, transcript_version, summary, n):
+        return list(self.stream_quiz(transcript_version, summary, n))
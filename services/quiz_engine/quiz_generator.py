@@ -0,0 +1,237 @@
+"""Sharded quiz generation.
+
+The summary is split into contiguous parts and each part gets its own small
+Gemini request. Shards run concurrently and stream their output; questions
+are parsed, validated and handed on as soon as each one is complete, with
+near-identical questions dropped. A shard that fails or returns too few
+valid questions is retried on its own for the questions still missing.
+"""
+import math
+import queue
+import re
+import threading
+import time
+
+from common import llm_gateway
+from common import metrics
+from stream_parser import QuestionStreamParser
+
+
+QUIZ_SHARDS = 4
+SHARD_RETRIES = 2
+# Each shard asks for this many questions beyond its share, to absorb dedup.
+SHARD_OVERSAMPLE = 1
+# Rough output budget per generated question (text, 4 options, explanation).
+TOKENS_PER_QUESTION = 150
+OPTIONS_PER_QUESTION = 4
+# Questions whose content words overlap at least this much (Jaccard) are duplicates.
+NEAR_DUPLICATE_OVERLAP = 0.8
+
+STOPWORDS = frozenset(
+    "a an and are as about be by do does following for in is it of on or the this that "
+    "to what when which who why how with".split()
+)
+
+PROMPT_TEMPLATE = """
+Based on the following part of a lecture summary, generate {count} multiple choice questions.
+Only ask about material in this part.{question_set}
+Each should include:
+- question (string)
+- options (list of 4 strings)
+- answer (correct option as text)
+- explanation (why this answer is correct)
+Format response as JSON list.
+
+Summary part {part_number} of {part_total}:
+{part}
+"""
+# Added for bank batches, so successive batches are distinct requests and cover different details.
+QUESTION_SET_NOTE = " This is question set {number}; ask about different details than other sets."
+
+
+class QuizGenerationError(Exception):
+    pass
+
+
+def split_summary(summary, parts):
+    """Split a summary into at most `parts` contiguous pieces of similar length."""
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+|\n{2,}", summary.strip()) if s.strip()]
+    if len(sentences) < parts:
+        return [summary]
+
+    target = len(summary) / parts
+    pieces = []
+    current = []
+    offset = 0
+    for sentence in sentences:
+        # Start the next part at the sentence boundary nearest to its target offset.
+        boundary = (len(pieces) + 1) * target
+        if current and len(pieces) < parts - 1 and offset + len(sentence) / 2 > boundary:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(sentence)
+        offset += len(sentence) + 1
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def normalize_question(q):
+    """Return a clean question dict, or None if it is not a usable question."""
+    if not isinstance(q, dict):
+        return None
+    question = q.get("question")
+    options = q.get("options")
+    answer = q.get("answer")
+    if not isinstance(question, str) or not question.strip():
+        return None
+    if not isinstance(options, list) or len(options) != OPTIONS_PER_QUESTION:
+        return None
+    options = [str(option).strip() for option in options]
+    if len(set(options)) != len(options) or not isinstance(answer, str):
+        return None
+
+    answer = answer.strip()
+    if answer not in options:
+        # Models sometimes change case or drop a trailing period.
+        matches = [o for o in options if o.lower().rstrip(".") == answer.lower().rstrip(".")]
+        if len(matches) != 1:
+            return None
+        answer = matches[0]
+
+    return {
+        "question": question.strip(),
+        "options": options,
+        "answer": answer,
+        "explanation": str(q.get("explanation") or "").strip(),
+    }
+
+
+def dedup_key(question):
+    return re.sub(r"[^a-z0-9]+", " ", question["question"].lower()).strip()
+
+
+def question_tokens(question):
+    """Content words of a question, for near-duplicate comparison."""
+    words = set(dedup_key(question).split())
+    return (words - STOPWORDS) or words
+
+
+class DuplicateFilter:
+    """Accepts questions unless they are identical or near-identical to one already accepted.
+
+    Near-identical means the content words overlap by at least
+    NEAR_DUPLICATE_OVERLAP, e.g. the same question with reordered or
+    slightly reworded phrasing.
+    """
+
+    def __init__(self, questions=()):
+        self._keys = set()
+        self._token_sets = []
+        for q in questions:
+            self.add(q)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, question):
+        """Remember the question and return True, or return False if it is a duplicate."""
+        key = dedup_key(question)
+        if key in self._keys:
+            return False
+        tokens = question_tokens(question)
+        for other in self._token_sets:
+            if len(tokens & other) >= NEAR_DUPLICATE_OVERLAP * len(tokens | other):
+                return False
+        self._keys.add(key)
+        self._token_sets.append(tokens)
+        return True
+
+
+def parse_question_stream(chunks):
+    """Yield validated questions from streamed model output as each one closes."""
+    parser = QuestionStreamParser()
+    for chunk in chunks:
+        yield from filter(None, map(normalize_question, parser.feed(chunk)))
+    yield from filter(None, map(normalize_question, parser.close()))
+
+
+def generate_shard_stream(part, part_number, part_total, count, priority=llm_gateway.PRIORITY_INTERACTIVE,
+                          question_set=None):
+    """Yield up to `count` validated questions for one summary part as they are generated."""
+    produced = 0
+    note = QUESTION_SET_NOTE.format(number=question_set) if question_set else ""
+    for attempt in range(SHARD_RETRIES + 1):
+        remaining = count - produced
+        prompt = PROMPT_TEMPLATE.format(count=remaining, part_number=part_number, part_total=part_total,
+                                        part=part, question_set=note)
+        if attempt:
+            metrics.count("quiz_shard_retries")
+        start = time.perf_counter()
+        try:
+            chunks = llm_gateway.generate_stream(
+                prompt,
+                expected_output_tokens=remaining * TOKENS_PER_QUESTION,
+                truncate=True,
+                priority=priority,
+            )
+            for q in parse_question_stream(chunks):
+                yield q
+                produced += 1
+                if produced >= count:
+                    metrics.observe("quiz_shard", time.perf_counter() - start)
+                    return
+        except Exception as e:
+            metrics.observe("quiz_shard", time.perf_counter() - start, "error")
+            print(f"[QUIZ] Shard {part_number}/{part_total} attempt {attempt + 1} failed: {e}")
+        else:
+            metrics.observe("quiz_shard", time.perf_counter() - start, "short")
+        print(f"[QUIZ] Shard {part_number}/{part_total} attempt {attempt + 1}: {produced}/{count} valid questions so far")
+
+
+def stream_quiz(summary, total, shards=QUIZ_SHARDS, priority=llm_gateway.PRIORITY_INTERACTIVE,
+                question_set=None, keep_extra=False):
+    """Yield up to `total` distinct questions from `shards` concurrent Gemini requests.
+
+    Questions are yielded in arrival order, so the first one is available as
+    soon as any shard has produced it. Callers asking for several sets from
+    the same summary number them with `question_set`; identical prompts would
+    otherwise join a previous set's shards that are still in flight.
+
+    With keep_extra, every shard runs to completion and the oversampled
+    questions beyond `total` are yielded too, instead of being discarded.
+    """
+    parts = split_summary(summary, shards)
+    # Too little text to split evenly; spare shards work on the whole summary.
+    parts += [summary] * (shards - len(parts))
+    per_shard = math.ceil(total / shards) + SHARD_OVERSAMPLE
+
+    results = queue.Queue()
+    finished = object()
+
+    def run_shard(part, part_number):
+        try:
+            for q in generate_shard_stream(part, part_number, shards, per_shard, priority, question_set):
+                results.put(q)
+        finally:
+            results.put(finished)
+
+    for i, part in enumerate(parts):
+        threading.Thread(target=metrics.in_current_trace(run_shard), args=(part, i + 1), daemon=True).start()
+
+    seen = DuplicateFilter()
+    running = shards
+    yielded = 0
+    while running and (keep_extra or yielded < total):
+        q = results.get()
+        if q is finished:
+            running -= 1
+            continue
+        if not seen.add(q):
+            continue
+        yielded += 1
+        yield q
+
+    print(f"[QUIZ] Generated {yielded} questions from {shards} shards")
+    if not yielded:
+        raise QuizGenerationError("Gemini did not return any valid questions.")
@@ -0,0 +1,103 @@
+"""Per-quiz storage shared by all worker processes.
+
+Every generated quiz gets its own ID. The questions and a compact answer key
+(one byte per question: the index of the correct option) are stored in
+SQLite, so /submit grades against the quiz the student actually received,
+whichever worker process serves it. Quizzes expire after QUIZ_TTL_SECONDS.
+"""
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+
+# Shares the question bank's database file unless configured otherwise.
+QUIZ_STORE_PATH = os.environ.get(
+    "QUIZ_STORE_PATH", os.environ.get("QUESTION_BANK_PATH", "question_bank.db")
+)
+QUIZ_TTL_SECONDS = int(os.environ.get("QUIZ_TTL_SECONDS", 4 * 3600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS quizzes (
+    quiz_id TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    questions TEXT NOT NULL,
+    answer_key BLOB NOT NULL
+)
+"""
+EXPIRY_INDEX = "CREATE INDEX IF NOT EXISTS quizzes_expires_at ON quizzes (expires_at)"
+
+
+class StoredQuiz:
+    __slots__ = ("quiz_id", "questions", "answer_key")
+
+    def __init__(self, quiz_id, questions, answer_key):
+        self.quiz_id = quiz_id
+        self.questions = questions
+        self.answer_key = answer_key
+
+
+def answer_key_for(quiz_data):
+    return bytes(q["options"].index(q["answer"]) for q in quiz_data)
+
+
+def grade(quiz, selections):
+    """Score a submission in one pass over the questions.
+
+    `selections` holds the chosen option index per question (None if
+    unanswered). Returns (score, analysis).
+    """
+    score = 0
+    analysis = []
+    for q, correct_index, selected in zip(quiz.questions, quiz.answer_key, selections):
+        is_correct = selected == correct_index
+        score += is_correct
+        analysis.append({
+            "question": q["question"],
+            "selected": q["options"][selected] if selected is not None else None,
+            "correct": q["options"][correct_index],
+            "is_correct": is_correct,
+            "explanation": q["explanation"]
+        })
+    return score, analysis
+
+
+class QuizStore:
+
+    def __init__(self, path=QUIZ_STORE_PATH, ttl=QUIZ_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(SCHEMA)
+            conn.execute(EXPIRY_INDEX)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def save(self, quiz_data):
+        """Store a quiz and return its ID. Expired quizzes are evicted on the way."""
+        quiz_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM quizzes WHERE expires_at < ?", (now,))
+            conn.execute(
+                "INSERT INTO quizzes (quiz_id, expires_at, questions, answer_key) VALUES (?, ?, ?, ?)",
+                (quiz_id, now + self.ttl, json.dumps(quiz_data), answer_key_for(quiz_data)),
+            )
+        return quiz_id
+
+    def load(self, quiz_id):
+        """Return the StoredQuiz for an ID, or None if it is unknown or expired."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT questions, answer_key FROM quizzes WHERE quiz_id = ? AND expires_at >= ?",
+                (quiz_id, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        return StoredQuiz(quiz_id, json.loads(row[0]), bytes(row[1]))
@@ -0,0 +1,102 @@
+"""Incremental parser for a streamed JSON list of question objects.
+
+Model output arrives in chunks. The parser scans each character once,
+tracking string/escape state and bracket nesting, and emits every item
+object as soon as its closing brace arrives. Code fences and chatter before
+the list are skipped. On close(), an unterminated last object is repaired
+from the tracked nesting state (close the open string and brackets) rather
+than by searching the text again.
+"""
+import json
+import re
+
+
+# A \uXXXX escape cut off before its four hex digits.
+PARTIAL_UNICODE_ESCAPE = re.compile(r"(\\+)u[0-9a-fA-F]{0,3}$")
+
+
+class QuestionStreamParser:
+
+    def __init__(self):
+        self._buffer = []
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._item_depth = None
+        self._done = False
+
+    def feed(self, text):
+        """Consume a chunk of model output and return the objects it completed."""
+        completed = []
+        for ch in text:
+            if self._done:
+                break
+            if self._item_depth is None:
+                # Skip fences and prose until the list (or a bare object) starts.
+                if ch == "[":
+                    self._item_depth = 1
+                    self._stack.append("[")
+                elif ch == "{":
+                    self._item_depth = 0
+                    self._stack.append("{")
+                    self._buffer.append(ch)
+                continue
+
+            in_item = len(self._stack) > self._item_depth
+            if in_item:
+                self._buffer.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                if not in_item:
+                    self._buffer.append(ch)
+                self._stack.append(ch)
+            elif ch in "]}":
+                if self._stack:
+                    self._stack.pop()
+                if len(self._stack) == self._item_depth and ch == "}":
+                    item = self._load("".join(self._buffer))
+                    if item is not None:
+                        completed.append(item)
+                    self._buffer = []
+                elif not self._stack:
+                    self._done = True
+        return completed
+
+    def close(self):
+        """Recover a truncated trailing object, if any."""
+        if not self._buffer:
+            return []
+        tail = "".join(self._buffer).rstrip()
+        self._buffer = []
+        if self._in_string:
+            # An escape cut off mid-way would swallow the closing quote.
+            if self._escape:
+                tail = tail[:-1]
+            else:
+                match = PARTIAL_UNICODE_ESCAPE.search(tail)
+                if match and len(match.group(1)) % 2:
+                    tail = tail[:match.end(1) - 1]
+            tail += '"'
+        tail = tail.rstrip(",:")
+        closers = "".join("}" if ch == "{" else "]" for ch in reversed(self._stack[self._item_depth:]))
+        item = self._load(tail + closers)
+        return [item] if item is not None else []
+
+    @staticmethod
+    def _load(text):
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        return item if isinstance(item, dict) else None
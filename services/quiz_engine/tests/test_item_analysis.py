@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+import item_analysis
+from quiz_store import StoredQuiz, answer_key_for
+
+
+OPTIONS = ["a", "b", "c", "d"]
+QUESTIONS = [
+    {"question": f"Q{i}", "options": OPTIONS, "answer": OPTIONS[i % 4], "explanation": ""}
+    for i in range(3)
+]
+
+
+@pytest.fixture
+def quiz():
+    return StoredQuiz("quiz-1", QUESTIONS, answer_key_for(QUESTIONS))
+
+
+def test_selection_index_accepts_indices_digit_strings_and_option_text():
+    lookup = {option: i for i, option in enumerate(OPTIONS)}
+    assert item_analysis.selection_index(2, OPTIONS, lookup) == 2
+    assert item_analysis.selection_index("3", OPTIONS, lookup) == 3
+    assert item_analysis.selection_index(" b ", OPTIONS, lookup) == 1
+    for answer in (None, True, 4, -1, "9", "zz", 1.5, {"a": 1}, [0]):
+        assert item_analysis.selection_index(answer, OPTIONS, lookup) == item_analysis.UNANSWERED
+
+
+@pytest.mark.parametrize("submission", [
+    {"answers": 5}, {"answers": "abc"}, {"answers": {"0": 1}}, "not an object",
+])
+def test_malformed_submissions_are_reported(submission):
+    assert item_analysis.submission_error(submission)
+
+
+def test_missing_answers_count_as_unanswered(quiz):
+    assert item_analysis.submission_error({"student_id": "s"}) is None
+    responses = item_analysis.response_matrix(quiz, [{"answers": [0]}, {}])
+    assert responses.tolist() == [[0, -1, -1], [-1, -1, -1]]
+
+
+def test_response_matrix_pads_and_truncates(quiz):
+    responses = item_analysis.response_matrix(quiz, [{"answers": ["a", "1", 2, 3, 0]}])
+    assert responses.dtype == np.int8
+    assert responses.tolist() == [[0, 1, 2]]
+
+
+def test_analyze_known_matrix(quiz):
+    # Answer key is [0, 1, 2]. Four students, best to worst.
+    responses = np.array([
+        [0, 1, 2],
+        [0, 1, 3],
+        [0, 0, -1],
+        [1, 0, -1],
+    ], dtype=np.int8)
+    scores, difficulty, discrimination, option_counts = item_analysis.analyze(quiz, responses)
+
+    assert scores.tolist() == [3, 2, 1, 0]
+    assert difficulty.tolist() == [0.75, 0.5, 0.25]
+    # Groups are round(4 * 0.27) = 1 student: the top scorer minus the bottom one.
+    assert discrimination.tolist() == [1.0, 1.0, 1.0]
+    assert option_counts.tolist() == [
+        [3, 1, 0, 0, 0],
+        [2, 2, 0, 0, 0],
+        [0, 0, 1, 1, 2],
+    ]
+
+
+def test_analyze_empty_class(quiz):
+    responses = item_analysis.response_matrix(quiz, [])
+    scores, difficulty, discrimination, option_counts = item_analysis.analyze(quiz, responses)
+    assert scores.tolist() == []
+    assert difficulty.tolist() == [0, 0, 0]
+    assert discrimination.tolist() == [0, 0, 0]
+    assert option_counts.sum() == 0
+
+
+def test_grade_class_report(quiz):
+    report = item_analysis.grade_class(quiz, [
+        {"student_id": "ann", "answers": [0, 1, 2]},
+        {"student_id": "bob", "answers": ["b", None, "c"]},
+    ])
+    assert [s["score"] for s in report["students"]] == [3, 1]
+    assert report["summary"] == {"students": 2, "mean": 2.0, "median": 2.0, "std": 1.0}
+    first = report["questions"][0]
+    assert first["correct_option"] == "a"
+    assert first["option_counts"] == {"a": 1, "b": 1, "c": 0, "d": 0}
+    assert first["distractors"] == {"b": 1, "c": 0, "d": 0}
+    assert report["questions"][1]["unanswered"] == 1
@@ -0,0 +1,141 @@
+import threading
+import time
+
+import pytest
+
+from common import llm_gateway
+import question_bank
+import quiz_generator
+from question_bank import QuestionBank
+
+
+def question(n):
+    return {"question": f"Which property defines concept{n}?", "options": ["a", "b", "c", "d"],
+            "answer": "a", "explanation": ""}
+
+
+class FakeGenerator:
+    """Stands in for quiz_generator.stream_quiz; each batch returns `total` plus oversampled questions."""
+
+    def __init__(self, extra=2):
+        self.extra = extra
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, summary, total, shards, priority, question_set=None, keep_extra=False):
+        self.calls.append({"total": total, "priority": priority, "question_set": question_set,
+                           "keep_extra": keep_extra})
+        self.release.wait(5)
+        for i in range(total + (self.extra if keep_extra else 0)):
+            yield question(question_set * 100 + i)
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    fake = FakeGenerator()
+    monkeypatch.setattr(quiz_generator, "stream_quiz", fake)
+    monkeypatch.setattr(question_bank, "BANK_BATCH_SIZE", 4)
+    monkeypatch.setattr(question_bank, "BANK_MIN_POOL", 5)
+    monkeypatch.setattr(question_bank, "BANK_TARGET_POOL", 8)
+    monkeypatch.setattr(question_bank, "FILL_POLL_SECONDS", 0.01)
+    return fake
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "bank.db")
+
+
+def wait_for_fill(bank, version):
+    deadline = time.time() + 5
+    while bank._fills.get(version) is not None:
+        assert time.time() < deadline, "fill did not finish"
+        time.sleep(0.01)
+
+
+def test_empty_pool_is_filled_to_target(generator, path):
+    bank = QuestionBank(path)
+    quiz = bank.get_quiz("v1", "summary", 3)
+    wait_for_fill(bank, "v1")
+
+    assert len(quiz) == 3
+    # Two batches of four, each keeping its two oversampled questions.
+    assert bank.count("v1") == 12
+    assert [call["question_set"] for call in generator.calls] == [1, 2]
+    assert all(call["keep_extra"] for call in generator.calls)
+
+
+def test_fill_batches_turn_background_once_the_request_is_served(generator, path):
+    bank = QuestionBank(path)
+    bank.get_quiz("v1", "summary", 3)
+    wait_for_fill(bank, "v1")
+
+    assert [call["priority"] for call in generator.calls] == [
+        llm_gateway.PRIORITY_INTERACTIVE, llm_gateway.PRIORITY_BACKGROUND,
+    ]
+
+
+def test_full_pool_is_sampled_without_generating(generator, path):
+    bank = QuestionBank(path)
+    bank.add("v1", [question(i) for i in range(6)])
+
+    quiz = bank.get_quiz("v1", "summary", 3)
+
+    assert len(quiz) == 3
+    assert bank._fills.get("v1") is None
+    assert generator.calls == []
+
+
+def test_fill_skips_questions_already_in_the_pool(generator, path):
+    bank = QuestionBank(path)
+    bank.add("v1", [question(100), question(101)])
+    bank.get_quiz("v1", "summary", 3)
+    wait_for_fill(bank, "v1")
+
+    # Set 1 repeats both pooled questions and adds its other four; set 2 adds all six.
+    assert [call["question_set"] for call in generator.calls] == [1, 2]
+    assert bank.count("v1") == 2 + 4 + 6
+
+
+def test_second_process_follows_the_running_fill(generator, path):
+    generator.release.clear()
+    owner = QuestionBank(path)
+    follower = QuestionBank(path)
+
+    owner_fill = owner.start_fill("v1", "summary", 3)
+    follower_fill = follower.start_fill("v1", "summary", 3)
+    generator.release.set()
+
+    owner_questions = list(owner_fill.follow())
+    follower_questions = list(follower_fill.follow())
+    assert len(generator.calls) == 2
+    assert follower_questions == owner_questions
+    assert len(owner_questions) == 12
+    assert follower_fill.error is None
+
+
+def test_follower_takes_over_an_expired_fill(generator, path, monkeypatch):
+    abandoned = QuestionBank(path)
+    monkeypatch.setattr(question_bank, "FILL_LEASE_SECONDS", 0.2)
+    assert abandoned._claim_fill("v1")
+    monkeypatch.setattr(question_bank, "FILL_LEASE_SECONDS", 30)
+
+    bank = QuestionBank(path)
+    quiz = bank.get_quiz("v1", "summary", 3)
+    wait_for_fill(bank, "v1")
+
+    assert len(quiz) == 3
+    assert len(generator.calls) == 2
+    assert bank._fill_lease("v1") is None
+
+
+def test_failed_fill_with_no_questions_raises(monkeypatch, path):
+    def stream_quiz(*args, **kwargs):
+        raise quiz_generator.QuizGenerationError("no questions")
+        yield
+
+    monkeypatch.setattr(quiz_generator, "stream_quiz", stream_quiz)
+    bank = QuestionBank(path)
+    with pytest.raises(quiz_generator.QuizGenerationError, match="no questions"):
+        bank.get_quiz("v1", "summary", 3)
@@ -0,0 +1,104 @@
+import pytest
+
+import quiz_generator
+from quiz_generator import DuplicateFilter, normalize_question, split_summary
+
+
+def question(text, options=("a", "b", "c", "d"), answer="b", explanation="because"):
+    return {"question": text, "options": list(options), "answer": answer, "explanation": explanation}
+
+
+def test_split_summary_keeps_short_summaries_whole():
+    summary = "One sentence. Two sentences."
+    assert split_summary(summary, 4) == [summary]
+
+
+def test_split_summary_makes_contiguous_parts_of_similar_length():
+    sentences = [f"Sentence number {i} is here." for i in range(12)]
+    parts = split_summary(" ".join(sentences), 4)
+    assert len(parts) == 4
+    assert " ".join(parts) == " ".join(sentences)
+    assert max(map(len, parts)) <= 2 * min(map(len, parts))
+
+
+def test_split_summary_splits_on_paragraphs():
+    parts = split_summary("The first paragraph, a long one\n\nThe second", 2)
+    assert parts == ["The first paragraph, a long one", "The second"]
+
+
+def test_normalize_question_strips_fields():
+    q = normalize_question({
+        "question": "  What is two plus two? ",
+        "options": [" 3", "4 ", 5, "6"],
+        "answer": " 4",
+        "explanation": None,
+    })
+    assert q == {"question": "What is two plus two?", "options": ["3", "4", "5", "6"],
+                 "answer": "4", "explanation": ""}
+
+
+def test_normalize_question_matches_answer_case_and_trailing_period():
+    q = normalize_question(question("Q?", options=["Paris.", "Rome", "Oslo", "Bern"], answer="paris"))
+    assert q["answer"] == "Paris."
+
+
+@pytest.mark.parametrize("raw", [
+    "not a dict",
+    question(""),
+    question(None),
+    question("Q?", options=["a", "b", "c"]),
+    question("Q?", options=["a", "a", "c", "d"]),
+    question("Q?", answer="e"),
+    question("Q?", answer=1),
+    question("Q?", options=["A", "a.", "c", "d"], answer="a"),
+])
+def test_normalize_question_rejects_unusable_questions(raw):
+    assert normalize_question(raw) is None
+
+
+def test_duplicate_filter_rejects_identical_questions():
+    seen = DuplicateFilter([question("What is photosynthesis?")])
+    assert not seen.add(question("what is PHOTOSYNTHESIS"))
+    assert len(seen) == 1
+
+
+def test_duplicate_filter_rejects_near_identical_questions():
+    seen = DuplicateFilter()
+    assert seen.add(question("Which organelle produces energy in the cell?"))
+    assert not seen.add(question("In the cell, which organelle produces energy?"))
+    assert not seen.add(question("Which organelle produces the energy in a cell?"))
+
+
+def test_duplicate_filter_accepts_different_questions():
+    seen = DuplicateFilter()
+    assert seen.add(question("Which organelle produces energy in the cell?"))
+    assert seen.add(question("Which organelle stores genetic material?"))
+    assert len(seen) == 2
+
+
+def test_dedup_key_ignores_case_and_punctuation():
+    assert quiz_generator.dedup_key(question("What's  the Answer?")) == "what s the answer"
+
+
+def fake_shards(monkeypatch):
+    def generate_shard_stream(part, part_number, part_total, count, priority, question_set):
+        for i in range(count):
+            yield question(f"Shard{part_number} asks about topic{i}?")
+    monkeypatch.setattr(quiz_generator, "generate_shard_stream", generate_shard_stream)
+
+
+def test_stream_quiz_stops_at_total(monkeypatch):
+    fake_shards(monkeypatch)
+    assert len(list(quiz_generator.stream_quiz("summary", 4, shards=2))) == 4
+
+
+def test_stream_quiz_keeps_oversampled_questions_when_asked(monkeypatch):
+    fake_shards(monkeypatch)
+    questions = list(quiz_generator.stream_quiz("summary", 4, shards=2, keep_extra=True))
+    assert len(questions) == 2 * (2 + quiz_generator.SHARD_OVERSAMPLE)
+
+
+def test_stream_quiz_fails_without_valid_questions(monkeypatch):
+    monkeypatch.setattr(quiz_generator, "generate_shard_stream", lambda *args: iter(()))
+    with pytest.raises(quiz_generator.QuizGenerationError):
+        list(quiz_generator.stream_quiz("summary", 4, shards=2))
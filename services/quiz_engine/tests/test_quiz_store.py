@@ -0,0 +1,44 @@
+
+from quiz_store import QuizStore, StoredQuiz, answer_key_for, grade
+
+
+QUESTIONS = [
+    {"question": "Q1", "options": ["a", "b", "c", "d"], "answer": "c", "explanation": "e1"},
+    {"question": "Q2", "options": ["w", "x", "y", "z"], "answer": "w", "explanation": "e2"},
+]
+
+
+def test_answer_key_is_one_byte_per_question():
+    assert answer_key_for(QUESTIONS) == bytes([2, 0])
+
+
+def test_save_and_load_round_trip(tmp_path):
+    store = QuizStore(str(tmp_path / "quizzes.db"))
+    quiz_id = store.save(QUESTIONS)
+    quiz = store.load(quiz_id)
+    assert quiz.quiz_id == quiz_id
+    assert quiz.questions == QUESTIONS
+    assert quiz.answer_key == bytes([2, 0])
+
+
+def test_unknown_and_expired_quizzes_are_not_loaded(tmp_path):
+    store = QuizStore(str(tmp_path / "quizzes.db"), ttl=-1)
+    quiz_id = store.save(QUESTIONS)
+    assert store.load(quiz_id) is None
+    assert store.load("missing") is None
+
+
+def test_quiz_ids_are_unique(tmp_path):
+    store = QuizStore(str(tmp_path / "quizzes.db"))
+    assert store.save(QUESTIONS) != store.save(QUESTIONS)
+
+
+def test_grade():
+    quiz = StoredQuiz("q", QUESTIONS, answer_key_for(QUESTIONS))
+    score, analysis = grade(quiz, [2, None])
+    assert score == 1
+    assert analysis[0] == {
+        "question": "Q1", "selected": "c", "correct": "c", "is_correct": True, "explanation": "e1",
+    }
+    assert analysis[1]["selected"] is None
+    assert analysis[1]["is_correct"] is False
@@ -0,0 +1,92 @@
+import json
+
+from stream_parser import QuestionStreamParser
+
+
+QUESTIONS = [
+    {"question": "What does {x} [y] mean?", "options": ["a", "b", "c", "d"], "answer": "a",
+     "explanation": "Brackets } ] and an escaped \" quote inside strings."},
+    {"question": "Second", "options": ["1", "2", "3", "4"], "answer": "2", "explanation": "e"},
+]
+
+
+def parse(chunks):
+    parser = QuestionStreamParser()
+    items = []
+    for chunk in chunks:
+        items += parser.feed(chunk)
+    return items, parser.close()
+
+
+def test_fenced_list_with_brackets_inside_strings():
+    text = "Here is the quiz:\n```json\n" + json.dumps(QUESTIONS, indent=2) + "\n```\nDone."
+    items, tail = parse([text])
+    assert items == QUESTIONS
+    assert tail == []
+
+
+def test_items_complete_in_arrival_order_across_any_chunking():
+    text = json.dumps(QUESTIONS)
+    for size in (1, 3, 7, 64):
+        parser = QuestionStreamParser()
+        seen = []
+        for start in range(0, len(text), size):
+            seen += parser.feed(text[start:start + size])
+        assert seen == QUESTIONS
+
+
+def test_first_item_is_emitted_before_the_list_closes():
+    text = json.dumps(QUESTIONS)
+    parser = QuestionStreamParser()
+    first_end = text.index("}, {") + 1
+    assert parser.feed(text[:first_end]) == [QUESTIONS[0]]
+    assert parser.feed(text[first_end:]) == [QUESTIONS[1]]
+
+
+def test_text_after_the_list_is_ignored():
+    items, tail = parse([json.dumps(QUESTIONS[:1]) + ' [{"question": "ignored"}]'])
+    assert items == QUESTIONS[:1]
+    assert tail == []
+
+
+def test_bare_object_without_list():
+    items, _ = parse(["```json\n" + json.dumps(QUESTIONS[1]) + "\n```"])
+    assert items == [QUESTIONS[1]]
+
+
+def test_truncated_tail_is_repaired():
+    text = json.dumps(QUESTIONS)
+    cut = text.index('"explanation": "e"') + len('"explanation": "')
+    items, tail = parse([text[:cut]])
+    assert items == QUESTIONS[:1]
+    assert tail == [dict(QUESTIONS[1], explanation="")]
+
+
+def test_truncated_nested_list_is_repaired():
+    items, tail = parse(['[{"question": "q", "options": ["a", "b'])
+    assert items == []
+    assert tail == [{"question": "q", "options": ["a", "b"]}]
+
+
+def test_tail_cut_after_a_backslash_is_repaired():
+    _, tail = parse(['[{"question": "say \\'])
+    assert tail == [{"question": "say "}]
+
+
+def test_tail_cut_inside_a_unicode_escape_is_repaired():
+    _, tail = parse(['[{"question": "caf\\u00'])
+    assert tail == [{"question": "caf"}]
+
+
+def test_escaped_backslash_before_the_cut_is_kept():
+    _, tail = parse(['[{"question": "a\\\\'])
+    assert tail == [{"question": "a\\"}]
+
+
+def test_invalid_items_are_skipped():
+    items, _ = parse(['[{"question": oops}, {"question": "ok"}]'])
+    assert items == [{"question": "ok"}]
+
+
+def test_close_without_input():
+    assert QuestionStreamParser().close() == []
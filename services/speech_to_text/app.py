@@ -5,13 +5,18 @@ from werkzeug.utils import secure_filename
 import os
 import uuid
 import json
+import hashlib
 import subprocess
 from pydub.utils import mediainfo 
 import concurrent.futures 
 import threading
+import time
 from google.oauth2 import service_account
 
+from common import metrics
+
 app = Flask(__name__)
+metrics.init_app(app, "speech_to_text")
 app.config["UPLOAD_EXTENSIONS"] = [".mp3", ".wav", ".flac", ".ogg", ".opus", ".webm", ".mp4", ".m4a"]
 app.config["UPLOAD_FOLDER"] = "temp"
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
@@ -30,6 +35,9 @@ credentials = service_account.Credentials.from_service_account_file(
 
 GCS_BUCKET_NAME = "autoquiz"
 
+# Alternate Speech-to-Text endpoint (REST), e.g. the load-test fake backend.
+SPEECH_API_ENDPOINT = os.environ.get("SPEECH_API_ENDPOINT")
+
 
 MIN_CHUNK_DURATION_SECONDS = 30 * 60 
 CHUNK_DURATION_SECONDS = 900 
@@ -41,6 +49,33 @@ jobs = {}
 
 
 
+def transcript_version_of(transcript):
+    """Content hash used by the summarizer and quiz engine to key their caches."""
+    return hashlib.sha256(transcript.encode("utf-8")).hexdigest()[:16]
+
+def save_latest_transcript(transcript):
+    # Write a temporary file and rename it, so concurrent readers never see a partial file.
+    temp_path = f"latest_transcript.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "transcript": transcript,
+            "transcript_version": transcript_version_of(transcript),
+        }, f)
+    os.replace(temp_path, "latest_transcript.json")
+
+def load_latest_transcript():
+    with open("latest_transcript.json", "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if "transcript_version" not in data:
+        data["transcript_version"] = transcript_version_of(data.get("transcript", ""))
+    return data
+
+def make_speech_client():
+    if SPEECH_API_ENDPOINT:
+        return speech.SpeechClient(transport="rest", client_options={"api_endpoint": SPEECH_API_ENDPOINT})
+    return speech.SpeechClient()
+
+@metrics.timed("probe_duration")
 def get_audio_duration(file_path):
     if not os.path.exists(file_path):
         print(f"[ERROR] get_audio_duration: File not found at {file_path}")
@@ -87,6 +122,7 @@ def get_audio_duration(file_path):
     
     return 0.0
 
+@metrics.timed("ffmpeg_convert")
 def convert_to_flac(input_path, output_path):
     print(f"[CONVERT] Starting conversion of {input_path} to FLAC...")
     try:
@@ -113,6 +149,7 @@ def convert_to_flac(input_path, output_path):
         print(f"[ERROR] Failed to convert audio: {e}")
         raise
 
+@metrics.timed("ffmpeg_convert_mic")
 def convert_webm_to_mp3(input_path, output_path):
     print(f"[CONVERT] Converting WebM {input_path} to MP3 {output_path}...")
     try:
@@ -149,6 +186,7 @@ def convert_webm_to_mp3(input_path, output_path):
         print(f"[ERROR] Failed to convert WebM to MP3: {e}")
         raise
 
+@metrics.timed("ffmpeg_split")
 def split_audio_into_chunks(input_path, output_dir, base_filename, chunk_duration):
     print(f"[SPLIT] Starting audio splitting for {input_path} into {chunk_duration}s chunks...")
     output_chunk_paths = []
@@ -194,6 +232,7 @@ def split_audio_into_chunks(input_path, output_dir, base_filename, chunk_duratio
     print(f"[SPLIT] Finished splitting {input_path} into {len(output_chunk_paths)} chunks.")
     return output_chunk_paths
 
+@metrics.timed("gcs_upload")
 def upload_to_gcs(file_path, blob_name):
     print(f"[UPLOAD] Starting upload of {file_path} to GCS bucket {GCS_BUCKET_NAME} as {blob_name}...")
     try:
@@ -214,10 +253,11 @@ def delete_from_gcs(blob_name):
         blob_name (str): The name of the blob to delete.
     """
     try:
-        client = storage.Client()
-        bucket = client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(blob_name)
-        blob.delete()
+        with metrics.stage("gcs_delete"):
+            client = storage.Client()
+            bucket = client.bucket(GCS_BUCKET_NAME)
+            blob = bucket.blob(blob_name)
+            blob.delete()
         print(f"[CLEANUP] Deleted from GCS: {blob_name}")
     except Exception as e:
         print(f"[CLEANUP WARN] Could not delete GCS blob {blob_name}: {e}")
@@ -225,6 +265,7 @@ def delete_from_gcs(blob_name):
 def transcribe_single_file_async(job_id, original_audio_path):
     flac_path = None
     blob_name = f"{job_id}.flac" 
+    start = time.perf_counter()
     try:
         jobs[job_id]["status"] = "converting"
         print(f"[JOB {job_id}] Status: Converting audio to FLAC...")
@@ -235,7 +276,7 @@ def transcribe_single_file_async(job_id, original_audio_path):
         print(f"[JOB {job_id}] Status: Uploading to GCS...")
         gcs_uri = upload_to_gcs(flac_path, blob_name)
         
-        client = speech.SpeechClient()
+        client = make_speech_client()
         
         audio = speech.RecognitionAudio(uri=gcs_uri)
         config = speech.RecognitionConfig(
@@ -252,11 +293,12 @@ def transcribe_single_file_async(job_id, original_audio_path):
 
         jobs[job_id]["status"] = "transcribing"
         print(f"[JOB {job_id}] Status: Starting Google Speech-to-Text long-running recognition with model '{config.model}'...")
-        operation = client.long_running_recognize(config=config, audio=audio)
-        
-        
-        print(f"[JOB {job_id}] Waiting for transcription result with a timeout of 10800 seconds...")
-        response = operation.result(timeout=10800)
+        with metrics.stage("speech_recognize"):
+            operation = client.long_running_recognize(config=config, audio=audio)
+            
+            
+            print(f"[JOB {job_id}] Waiting for transcription result with a timeout of 10800 seconds...")
+            response = operation.result(timeout=10800)
 
         transcript_parts = []
         for result in response.results:
@@ -268,15 +310,18 @@ def transcribe_single_file_async(job_id, original_audio_path):
 
         jobs[job_id]["status"] = "done"
         jobs[job_id]["transcript"] = transcript
+        metrics.count("transcriptions_completed")
         print(f"[JOB {job_id}] Completed successfully.")
         
         
-        with open("latest_transcript.json", "w", encoding="utf-8") as f:
-            json.dump({"transcript": transcript}, f)
+        save_latest_transcript(transcript)
+        metrics.observe("transcription_job", time.perf_counter() - start)
 
     except Exception as e:
         jobs[job_id]["status"] = "error"
         jobs[job_id]["error"] = str(e)
+        metrics.count("transcriptions_failed")
+        metrics.observe("transcription_job", time.perf_counter() - start, "error")
         print(f"[ERROR] Job {job_id} failed: {e}")
     finally:
         if blob_name:
@@ -291,12 +336,13 @@ def transcribe_single_file_async(job_id, original_audio_path):
 def transcribe_mic_direct_async(job_id, mp3_audio_path):
     blob_name = f"{job_id}.mp3" 
     gcs_uri = None
+    start = time.perf_counter()
     try:
         jobs[job_id]["status"] = "uploading"
         print(f"[JOB {job_id}] Status: Uploading microphone MP3 to GCS...")
         gcs_uri = upload_to_gcs(mp3_audio_path, blob_name)
         
-        client = speech.SpeechClient()
+        client = make_speech_client()
         
         audio = speech.RecognitionAudio(uri=gcs_uri)
         config = speech.RecognitionConfig(
@@ -313,10 +359,11 @@ def transcribe_mic_direct_async(job_id, mp3_audio_path):
 
         jobs[job_id]["status"] = "transcribing"
         print(f"[JOB {job_id}] Status: Starting Google Speech-to-Text recognition for MP3...")
-        operation = client.long_running_recognize(config=config, audio=audio)
-        
-        print(f"[JOB {job_id}] Waiting for MP3 transcription result with a timeout of 10800 seconds...")
-        response = operation.result(timeout=10800)
+        with metrics.stage("speech_recognize"):
+            operation = client.long_running_recognize(config=config, audio=audio)
+            
+            print(f"[JOB {job_id}] Waiting for MP3 transcription result with a timeout of 10800 seconds...")
+            response = operation.result(timeout=10800)
 
         transcript_parts = []
         for result in response.results:
@@ -328,14 +375,17 @@ def transcribe_mic_direct_async(job_id, mp3_audio_path):
 
         jobs[job_id]["status"] = "done"
         jobs[job_id]["transcript"] = transcript
+        metrics.count("transcriptions_completed")
         print(f"[JOB {job_id}] MP3 transcription completed successfully.")
         
-        with open("latest_transcript.json", "w", encoding="utf-8") as f:
-            json.dump({"transcript": transcript}, f)
+        save_latest_transcript(transcript)
+        metrics.observe("transcription_job", time.perf_counter() - start)
 
     except Exception as e:
         jobs[job_id]["status"] = "error"
         jobs[job_id]["error"] = str(e)
+        metrics.count("transcriptions_failed")
+        metrics.observe("transcription_job", time.perf_counter() - start, "error")
         print(f"[ERROR] Job {job_id} (MP3) failed: {e}")
     finally:
         if gcs_uri:
@@ -352,7 +402,7 @@ def transcribe_chunk_async(parent_job_id, chunk_index, chunk_path, chunk_blob_na
         print(f"[JOB {parent_job_id}] Chunk {chunk_index}: Status: Uploading chunk to GCS...")
         gcs_uri = upload_to_gcs(chunk_path, chunk_blob_name)
         
-        client = speech.SpeechClient()
+        client = make_speech_client()
         
         audio = speech.RecognitionAudio(uri=gcs_uri)
         config = speech.RecognitionConfig(
@@ -369,12 +419,13 @@ def transcribe_chunk_async(parent_job_id, chunk_index, chunk_path, chunk_blob_na
         jobs[parent_job_id]["chunks"][chunk_index]["status"] = "transcribing_chunk"
         print(f"[JOB {parent_job_id}] Chunk {chunk_index}: Status: Starting Google Speech-to-Text recognition...")
         
-        operation = client.long_running_recognize(config=config, audio=audio)
-        
-        
-        chunk_timeout = CHUNK_DURATION_SECONDS * 4 
-        print(f"[JOB {parent_job_id}] Chunk {chunk_index}: Waiting for transcription result with a timeout of {chunk_timeout} seconds...")
-        response = operation.result(timeout=chunk_timeout)
+        with metrics.stage("speech_recognize_chunk"):
+            operation = client.long_running_recognize(config=config, audio=audio)
+            
+            
+            chunk_timeout = CHUNK_DURATION_SECONDS * 4 
+            print(f"[JOB {parent_job_id}] Chunk {chunk_index}: Waiting for transcription result with a timeout of {chunk_timeout} seconds...")
+            response = operation.result(timeout=chunk_timeout)
 
         transcript_parts = []
         for result in response.results:
@@ -391,6 +442,7 @@ def transcribe_chunk_async(parent_job_id, chunk_index, chunk_path, chunk_blob_na
     except Exception as e:
         jobs[parent_job_id]["chunks"][chunk_index]["status"] = "error"
         jobs[parent_job_id]["chunks"][chunk_index]["error"] = str(e)
+        metrics.count("chunk_transcriptions_failed")
         print(f"[ERROR] Job {parent_job_id} Chunk {chunk_index} failed: {e}")
     finally:
         
@@ -402,6 +454,7 @@ def transcribe_chunk_async(parent_job_id, chunk_index, chunk_path, chunk_blob_na
 
 
 def process_full_audio_for_chunking(parent_job_id, original_file_path, duration):
+    start = time.perf_counter()
     try:
         jobs[parent_job_id]["status"] = "splitting_audio"
         chunk_paths = split_audio_into_chunks(
@@ -428,7 +481,7 @@ def process_full_audio_for_chunking(parent_job_id, original_file_path, duration)
         
         with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CHUNK_TRANSCRIPTIONS) as executor:
             future_to_chunk = {
-                executor.submit(transcribe_chunk_async, parent_job_id, chunk_info["index"], chunk_info["local_path"], chunk_info["gcs_blob_name"]): chunk_info["index"]
+                executor.submit(metrics.in_current_trace(transcribe_chunk_async), parent_job_id, chunk_info["index"], chunk_info["local_path"], chunk_info["gcs_blob_name"]): chunk_info["index"]
                 for chunk_info in jobs[parent_job_id]["chunks"].values()
             }
             
@@ -438,11 +491,13 @@ def process_full_audio_for_chunking(parent_job_id, original_file_path, duration)
                     future.result() 
                 except Exception as exc:
                     print(f'[JOB {parent_job_id}] Chunk {chunk_index} generated an exception: {exc}')
-                   
+        metrics.observe("chunk_orchestration", time.perf_counter() - start)
 
     except Exception as e:
         jobs[parent_job_id]["status"] = "error"
         jobs[parent_job_id]["error"] = str(e)
+        metrics.count("transcriptions_failed")
+        metrics.observe("chunk_orchestration", time.perf_counter() - start, "error")
         print(f"[ERROR] Parent job {parent_job_id} failed during splitting or orchestration: {e}")
     finally:
         
@@ -463,6 +518,7 @@ def transcribe():
     file = request.files['file']
     
     job_id = str(uuid.uuid4())
+    print(f"[API] Job {job_id} belongs to trace {metrics.trace_id()}")
     
    
     mic_mode_raw = request.form.get("mic_mode")
@@ -507,7 +563,7 @@ def transcribe():
         jobs[job_id]["status"] = "processing" 
         print(f"[API] Received microphone transcription request. Job ID: {job_id}. Skipping duration check for direct transcription.")
         threading.Thread(
-            target=transcribe_mic_direct_async,
+            target=metrics.in_current_trace(transcribe_mic_direct_async),
             args=(job_id, mp3_file_path),
             daemon=True
         ).start()
@@ -545,7 +601,7 @@ def transcribe():
             }
             print(f"[API] Received chunked transcription request. Parent Job ID: {job_id}, Original Duration: {duration:.2f} seconds.")
             threading.Thread(
-                target=process_full_audio_for_chunking,
+                target=metrics.in_current_trace(process_full_audio_for_chunking),
                 args=(job_id, processed_file_path, duration),
                 daemon=True
             ).start()
@@ -559,7 +615,7 @@ def transcribe():
             }
             print(f"[API] Received single-file transcription request. Job ID: {job_id}, Duration: {duration:.2f} seconds.")
             threading.Thread(
-                target=transcribe_single_file_async,
+                target=metrics.in_current_trace(transcribe_single_file_async),
                 args=(job_id, processed_file_path),
                 daemon=True
             ).start()
@@ -636,9 +692,9 @@ def get_chunked_job_status(job_info):
         if job_info["status"] != "done": 
             job_info["status"] = "done"
             job_info["transcript"] = current_transcript
+            metrics.count("transcriptions_completed")
             print(f"[JOB {job_info['job_id']}] All chunks processed. Final transcript assembled.")
-            with open("latest_transcript.json", "w", encoding="utf-8") as f:
-                json.dump({"transcript": current_transcript}, f)
+            save_latest_transcript(current_transcript)
 
         return {
             "status": "done",
@@ -673,9 +729,19 @@ def status(job_id):
 @app.route("/latest_transcript", methods=["GET"])
 def latest_transcript():
     try:
-        with open("latest_transcript.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return jsonify(data)
+        return jsonify(load_latest_transcript())
+    except FileNotFoundError:
+        return jsonify({"error": "No latest transcript available. Upload an audio file first."}), 404
+    except json.JSONDecodeError:
+        return jsonify({"error": "Error decoding latest_transcript.json. File might be corrupted."}), 500
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/latest_transcript_version", methods=["GET"])
+def latest_transcript_version():
+    """Version of the latest transcript without the transcript body."""
+    try:
+        return jsonify({"transcript_version": load_latest_transcript()["transcript_version"]})
     except FileNotFoundError:
         return jsonify({"error": "No latest transcript available. Upload an audio file first."}), 404
     except json.JSONDecodeError:
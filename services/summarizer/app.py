@@ -1,23 +1,67 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, Response
 import requests
-import google.generativeai as genai
-import io
+import hashlib
 import os
 
+from common import llm_gateway
+from common import metrics
+from summary_store import DEFAULT_PROMPT_KEY, SummaryStore, prompt_key_of
+
 app = Flask(__name__)
+metrics.init_app(app, "summarizer")
+
+
+SPEECH_TO_TEXT_URL = os.environ.get("SPEECH_TO_TEXT_URL", "http://40.90.194.113:5001")
+SPEECH_TO_TEXT_API = f"{SPEECH_TO_TEXT_URL}/latest_transcript"
+
+DOWNLOAD_CHUNK_CHARS = 64 * 1024
+
+summaries = SummaryStore()
+
+
+def transcript_version_of(transcript_data, transcript):
+    """Version ID of a transcript: the one sent by speech_to_text, or a content hash."""
+    version = transcript_data.get("transcript_version")
+    if version:
+        return version
+    return hashlib.sha256(transcript.encode("utf-8")).hexdigest()[:16]
 
 
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+def requested_summary(prompt_key=DEFAULT_PROMPT_KEY):
+    """Entry for ?transcript_version=..., or the latest default-prompt one when not given."""
+    transcript_version = request.args.get("transcript_version")
+    if transcript_version:
+        return summaries.get(transcript_version, prompt_key)
+    return summaries.latest()
 
-genai.configure(api_key=GEMINI_API_KEY)  
-SPEECH_TO_TEXT_API = "http://40.90.194.113:5001/latest_transcript"
 
-latest_summary_text = None
+def conditional(response, entry):
+    response.set_etag(entry.etag)
+    response.last_modified = entry.last_modified
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+def generate_summary(transcript_version, transcript, custom_prompt=""):
+    if custom_prompt:
+        prompt = f"{custom_prompt}\n\nTranscript:\n{transcript}"
+    else:
+        prompt = f"Summarize the following contents and give an in-depth explanation:\n\n{transcript}"
+
+    print(f"Generating summary with prompt length: {len(prompt)} characters")
+
+    # Summary length scales with the transcript; short ones are routed to the fast model.
+    expected_tokens = min(max(llm_gateway.estimate_tokens(transcript) // 2, 512), 4096)
+    with metrics.stage("summarize"):
+        summary_text = llm_gateway.generate(prompt, expected_output_tokens=expected_tokens, truncate=True)
+    return summaries.put(transcript_version, summary_text, prompt_key_of(custom_prompt))
+
 
 @app.route("/", methods=["GET", "POST"])
 def summarize():
-    global latest_summary_text
     summary_text = None
+    transcript_version = None
+    prompt_key = DEFAULT_PROMPT_KEY
     status_message = None
     status_type = "info"
 
@@ -25,7 +69,8 @@ def summarize():
         try:
             
             print("Fetching transcript from:", SPEECH_TO_TEXT_API)
-            response = requests.get(SPEECH_TO_TEXT_API, timeout=10)
+            with metrics.stage("fetch_transcript"):
+                response = requests.get(SPEECH_TO_TEXT_API, headers=metrics.trace_headers(), timeout=10)
             
             if response.status_code != 200:
                 status_message = f"❌ Error fetching transcript: {response.text}"
@@ -47,21 +92,13 @@ def summarize():
                                      status_type=status_type)
             
             
+            transcript_version = transcript_version_of(transcript_data, transcript)
             custom_prompt = request.form.get("custom_prompt", "").strip()
             
             
-            if custom_prompt:
-                prompt = f"{custom_prompt}\n\nTranscript:\n{transcript}"
-            else:
-                prompt = f"Summarize the following contents and give an in-depth explanation:\n\n{transcript}"
-            
-            print(f"Generating summary with prompt length: {len(prompt)} characters")
-            
-            
-            model = genai.GenerativeModel("gemini-1.5-pro-latest")
-            gemini_response = model.generate_content(prompt)
-            summary_text = gemini_response.text.strip()
-            latest_summary_text = summary_text
+            entry = generate_summary(transcript_version, transcript, custom_prompt)
+            summary_text = entry.text
+            prompt_key = entry.prompt_key
             
             status_message = "✅ Summary generated successfully!"
             status_type = "success"
@@ -77,30 +114,80 @@ def summarize():
 
     return render_template('index.html', 
                          summary=summary_text,
+                         transcript_version=transcript_version,
+                         prompt_key=prompt_key,
                          status_message=status_message,
                          status_type=status_type)
 
 
+@app.route("/api/summary", methods=["POST"])
+def ensure_summary():
+    """Return the summary of the latest transcript, generating it only if none exists for its version"""
+    try:
+        with metrics.stage("fetch_transcript"):
+            response = requests.get(SPEECH_TO_TEXT_API, headers=metrics.trace_headers(), timeout=10)
+    except requests.RequestException as e:
+        return jsonify({"error": f"Unable to fetch transcript: {e}"}), 502
+    if response.status_code != 200:
+        return jsonify({"error": f"Error fetching transcript: {response.text}"}), 502
+
+    transcript_data = response.json()
+    transcript = transcript_data.get("transcript", "").strip()
+    if not transcript:
+        return jsonify({"error": "No transcript found"}), 404
+
+    transcript_version = transcript_version_of(transcript_data, transcript)
+    entry = summaries.get(transcript_version)
+    generated = entry is None
+    metrics.count("summary_store_miss" if generated else "summary_store_hit")
+    if generated:
+        try:
+            entry = generate_summary(transcript_version, transcript)
+        except Exception as e:
+            print(f"Summary generation error: {e}")
+            return jsonify({"error": f"Error generating summary: {e}"}), 500
+
+    return jsonify({
+        "summary": entry.text,
+        "transcript_version": entry.transcript_version,
+        "prompt_key": entry.prompt_key,
+        "generated": generated,
+    })
+
+
 @app.route("/latest_summary", methods=["GET"])
 def get_latest_summary():
-    """API endpoint to get the latest summary as JSON"""
-    if latest_summary_text:
-        return jsonify({"summary": latest_summary_text})
-    return jsonify({"error": "No summary available"}), 404
+    """API endpoint to get the latest summary (or ?transcript_version=...&prompt=...) as JSON"""
+    entry = requested_summary(request.args.get("prompt", DEFAULT_PROMPT_KEY))
+    if entry is None:
+        return jsonify({"error": "No summary available"}), 404
+    response = jsonify({
+        "summary": entry.text,
+        "transcript_version": entry.transcript_version,
+        "prompt_key": entry.prompt_key,
+    })
+    return conditional(response, entry)
 
 
 @app.route("/download_summary", methods=["GET"])
 def download_summary():
-    """Download the latest summary as a text file"""
-    if latest_summary_text:
-        file_stream = io.StringIO(latest_summary_text)
-        return send_file(
-            io.BytesIO(file_stream.getvalue().encode("utf-8")),
-            as_attachment=True,
-            download_name="summary.txt",
-            mimetype="text/plain"
-        )
-    return jsonify({"error": "No summary available"}), 404
+    """Download the latest summary (or ?transcript_version=...&prompt=...) as a text file"""
+    entry = requested_summary(request.args.get("prompt", DEFAULT_PROMPT_KEY))
+    if entry is None:
+        return jsonify({"error": "No summary available"}), 404
+
+    def generate_chunks(text):
+        for start in range(0, len(text), DOWNLOAD_CHUNK_CHARS):
+            yield text[start:start + DOWNLOAD_CHUNK_CHARS].encode("utf-8")
+
+    response = Response(
+        generate_chunks(entry.text),
+        mimetype="text/plain",
+        headers={"Content-Disposition": "attachment; filename=summary.txt"},
+    )
+    # Otherwise make_conditional() drains the generator to compute Content-Length.
+    response.automatically_set_content_length = False
+    return conditional(response, entry)
 
 
 if __name__ == "__main__":
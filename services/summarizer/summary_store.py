@@ -0,0 +1,69 @@
+"""Bounded, thread-safe store of summaries keyed by transcript version and prompt.
+
+The default-prompt summary of a transcript version is the canonical one that
+other services read. Custom-prompt summaries are stored under their own
+prompt key so they never replace it.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+MAX_SUMMARIES = 256
+
+DEFAULT_PROMPT_KEY = "default"
+
+
+def prompt_key_of(custom_prompt):
+    """Store key for a prompt: DEFAULT_PROMPT_KEY, or a hash of the custom prompt."""
+    if not custom_prompt:
+        return DEFAULT_PROMPT_KEY
+    return hashlib.sha256(custom_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class SummaryEntry:
+    __slots__ = ("transcript_version", "prompt_key", "text", "etag", "last_modified")
+
+    def __init__(self, transcript_version, prompt_key, text):
+        self.transcript_version = transcript_version
+        self.prompt_key = prompt_key
+        self.text = text
+        self.etag = hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+        # HTTP dates have one-second resolution.
+        self.last_modified = int(time.time())
+
+
+class SummaryStore:
+    """LRU map of (transcript version, prompt key) -> SummaryEntry."""
+
+    def __init__(self, max_entries=MAX_SUMMARIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._latest_version = None
+
+    def put(self, transcript_version, text, prompt_key=DEFAULT_PROMPT_KEY):
+        entry = SummaryEntry(transcript_version, prompt_key, text)
+        key = (transcript_version, prompt_key)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if prompt_key == DEFAULT_PROMPT_KEY:
+                self._latest_version = transcript_version
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get(self, transcript_version, prompt_key=DEFAULT_PROMPT_KEY):
+        key = (transcript_version, prompt_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def latest(self):
+        """Most recently written default-prompt entry, or None."""
+        with self._lock:
+            return self._entries.get((self._latest_version, DEFAULT_PROMPT_KEY))